@@ -53,6 +53,15 @@ class Agent(ABC):
     def handle_event(self, event):
         pass
 
+    def catch_up(self, events):
+        '''
+        Handle several :events at once, e.g., when a game is rebuilt
+        from its log. Override if the agent can do better than handling
+        them one at a time (or doesn't need to see them at all).
+        '''
+        for event in events:
+            self.handle_event(event)
+
     @abstractmethod
     def select_action(self) -> Action:
         pass
@@ -3,6 +3,7 @@ from dataclasses import dataclass, asdict, field
 import json
 from typing import (
     # Any,
+    Callable,
     ClassVar,
     Dict,
     Iterable,
@@ -27,15 +28,23 @@ from custom_types import (
     Rewards,
     SecondsSinceEpoch,
     StateKey,
+    UndoToken,
 )
 
 
-@dataclass
+@dataclass(slots=True)
 class State(ABC):
+    '''
+    Slotted (no per-instance __dict__) to keep millions of live states
+    in search trees and replay buffers small. Subclasses should use
+    @dataclass(slots=True) too, and since slots=True rebuilds the class,
+    call super(Cls, self) explicitly rather than zero-arg super().
+    '''
     acting_agent: int
 
     _cached_is_terminal: Optional[bool] = field(init=False, default=None)
     _cached_eligible_actions: Optional[List[Action]] = field(init=False, default=None)
+    _cached_rewards: Optional[Rewards] = field(init=False, default=None)
 
     @classmethod
     def from_dict(cls, data: Dict) -> Instance:
@@ -59,6 +68,18 @@ class State(ABC):
             self._cached_eligible_actions = self.eligible_actions_lazy()
         return self._cached_eligible_actions
 
+    def rewards(self) -> Rewards:
+        '''
+        Rewards that each agent gets from this state.
+
+        Typically only non-zero when the state is terminal for board
+        games, but that's not strictly true.
+        '''
+        # Lazily set
+        if self._cached_rewards is None:
+            self._cached_rewards = self.rewards_lazy()
+        return self._cached_rewards
+
     @classmethod
     @abstractmethod
     def from_state_key(cls, state_key) -> Instance:
@@ -83,12 +104,12 @@ class State(ABC):
         pass
 
     @abstractmethod
-    def rewards(self) -> List[float]:
+    def rewards_lazy(self) -> Rewards:
         '''
-        Rewards that each agent gets from this state.
+        Method that is called the first time rewards is called and
+        result cached.
 
-        Typically called only when the state is terminal for board
-        games, but that's not strictly true.
+        Don't call this method directly, use rewards.
         '''
         pass
 
@@ -97,17 +118,32 @@ class State(ABC):
         pass
 
 
-@dataclass
+@dataclass(slots=True)
 class Event:
+    '''
+    :rewards are the rewards of :state, computed on first access (most
+    events are never asked for them).
+    '''
     action: Action
-    rewards: Rewards
     state: State
 
+    _cached_rewards: Optional[Rewards] = field(init=False, default=None)
+
+    @property
+    def rewards(self) -> Rewards:
+        # Lazily set
+        if self._cached_rewards is None:
+            self._cached_rewards = self.state.rewards()
+        return self._cached_rewards
+
     @classmethod
     def from_dict(cls, data, State):
-        state_key = data["state"]
-        data["state"] = State.from_state_key(state_key)
-        return cls(**data)
+        event = cls(
+            action=data["action"],
+            state=State.from_state_key(data["state"]),
+        )
+        event._cached_rewards = data.get("rewards")
+        return event
 
     def to_dict(self):
         return {
@@ -128,6 +164,9 @@ class Environment(ABC):
     start_time: SecondsSinceEpoch = field(init=False)
     end_time: SecondsSinceEpoch = field(init=False)
     random_seed: int = field(init=False)
+    rng: random.Random = field(init=False)
+    np_rng: numpy.random.Generator = field(init=False)
+    listeners: List[Callable[[Event], None]] = field(init=False)
 
     def __post_init__(self):
         self.id = str(uuid.uuid4())
@@ -136,6 +175,9 @@ class Environment(ABC):
         self.start_time = -1.0
         self.end_time = -1.0
         self.random_seed = None
+        self.rng = None
+        self.np_rng = None
+        self.listeners = []
         assert self.NAME
         assert self.STATE
 
@@ -147,18 +189,38 @@ class Environment(ABC):
         self.set_up()
 
     def set_seed(self, seed=None):
+        '''
+        Seed this environment's own random generators.
+
+        The global random/numpy state is left alone so several
+        environments can run interleaved in one process and each stay
+        reproducible. Anything random about a game (initial state,
+        transitions, random agents) should draw from :rng / :np_rng.
+        '''
         if seed is None:
             self.random_seed = random.randint(0, 100_000_000)
         else:
             self.random_seed = seed
-        random.seed(self.random_seed)
-        numpy.random.seed(self.random_seed)
+        self.rng = random.Random(self.random_seed)
+        self.np_rng = numpy.random.default_rng(self.random_seed)
 
     def add_agent(self, agent):
         self.agents.append(agent)
         agent.set_agent_num(len(self.agents) - 1)
         agent.environment = self
 
+    def add_listener(self, listener: Callable[[Event], None], first=False):
+        '''
+        Call :listener(event) after every event :advance adds (after the
+        agents have handled it), e.g., to push updates to clients.
+        Listeners run in the order they were added, except :first ones
+        run before all others.
+        '''
+        if first:
+            self.listeners.insert(0, listener)
+        else:
+            self.listeners.append(listener)
+
     def num_agents(self) -> int:
         return len(self.agents)
 
@@ -201,35 +263,42 @@ class Environment(ABC):
         to_display_string += f"\nRandom seed: {self.random_seed}"
         rprint(to_display_string)
 
-    def set_up(self, replay_history=None):
-        replay_history = replay_history if replay_history else []
+    def set_up(self, replay_history: Iterable[Event] = None):
+        '''
+        Start the game, or, given :replay_history (any iterable of
+        events, starting with the initial one, e.g., a generator over a
+        game log), rebuild it up to its last event.
 
+        Replay is one pass: the events are appended to event_history
+        in bulk and each agent gets a single catch_up call with all of
+        them rather than one handle_event per event.
+        '''
         # Make sure things that need to be set are set.
         assert self.id
         assert self.agents
         assert self.random_seed
 
         # Set up environment with initial state and let agents set up.
-        if replay_history:
-            initial_event = replay_history.pop(0)
-        else:
+        replay_history = iter(replay_history if replay_history else ())
+        initial_event = next(replay_history, None)
+        if initial_event is None:
             initial_event = Event(
                 action=None,
-                rewards=None,
                 state=self.initial_state(),
             )
-        self.event_history.append(initial_event)
+        event_history = self.event_history
+        event_history.append(initial_event)
         for agent in self.agents:
             agent.set_up()
 
         # Replay environment until last event
-        while replay_history:
-            event = replay_history.pop(0)
-            self.event_history.append(event)
-
-            # - XXX: mask unobservable state here.
+        # - XXX: mask unobservable state here.
+        start = len(event_history)
+        event_history.extend(replay_history)
+        if len(event_history) > start:
+            events = event_history[start:]
             for agent in self.agents:
-                agent.handle_event(event)
+                agent.catch_up(events)
 
     def advance(self, action):
         '''
@@ -253,12 +322,13 @@ class Environment(ABC):
         )
         event = Event(
             action=action,
-            rewards=next_state.rewards(),
             state=next_state,
         )
         self.event_history.append(event)
         for agent in self.agents:
             agent.handle_event(event)
+        for listener in self.listeners:
+            listener(event)
         # print("advance", state.acting_agent, "action", action)
 
     def run(self) -> Outcome:
@@ -303,6 +373,34 @@ class Environment(ABC):
 
         return event_history[-1].rewards
 
+    def rollout(self, state, policy=None) -> Outcome:
+        '''
+        Play from :state to a terminal state and return its rewards.
+
+        Fast path for playouts: no event history, agent notifications,
+        display checks or per-move rewards. :policy(state) -> action
+        picks each move (default: uniformly random from :rng). Uses the
+        in-place :apply on a copy of :state when the environment has
+        it, so :state itself is never modified.
+        '''
+        if policy is None:
+            choice = self.rng.choice
+
+            def policy(state):
+                return choice(state.eligible_actions())
+
+        if type(self).apply is Environment.apply:
+            transition = self.transition
+            while not state.is_terminal():
+                state = transition(state, policy(state))
+            return state.rewards()
+
+        apply = self.apply
+        state = state.copy()
+        while not state.is_terminal():
+            apply(state, policy(state))
+        return state.rewards()
+
     def run_hosted(self):
         '''
         Run environment until:
@@ -340,6 +438,25 @@ class Environment(ABC):
         '''
         pass
 
+    def apply(self, state, action) -> UndoToken:
+        '''
+        In-place :transition: update :state to the next state given
+        :action and return a token that :undo uses to restore it.
+
+        Meant for search/rollouts that walk one state forward and back
+        instead of allocating a State per move. :state must not be
+        shared (e.g., with event_history or a transposition table), so
+        copy it first.
+        '''
+        raise NotImplementedError()
+
+    def undo(self, state, token: UndoToken):
+        '''
+        Revert the :apply that returned :token. Undos must be done in
+        reverse order of the applies.
+        '''
+        raise NotImplementedError()
+
     @abstractmethod
     def parse_action_input(self, input_string) -> Action:
         pass
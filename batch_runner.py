@@ -0,0 +1,171 @@
+'''
+Run many games of an environment spread over a process pool.
+
+Each worker gets its own seed spawned from a master seed, so a batch is
+reproducible for a given (master_seed, num_workers) regardless of how the
+OS schedules the workers.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import math
+import os
+import random
+import time
+from typing import (
+    Any,
+    List,
+    Optional,
+    Sequence,
+)
+import numpy
+
+from settings import SETTINGS
+from run_contexts import RunContexts
+from custom_types import Outcome
+
+
+@dataclass
+class BatchResult:
+    num_games: int = 0
+    p1_wins: int = 0
+    reward_sums: List[float] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def merge(self, other):
+        self.num_games += other.num_games
+        self.p1_wins += other.p1_wins
+        if not self.reward_sums:
+            self.reward_sums = [0.0] * len(other.reward_sums)
+        for i, r in enumerate(other.reward_sums):
+            self.reward_sums[i] += r
+
+    def add_outcome(self, outcome: Outcome):
+        self.num_games += 1
+        if outcome[0] > 0:
+            self.p1_wins += 1
+        if not self.reward_sums:
+            self.reward_sums = [0.0] * len(outcome)
+        for i, r in enumerate(outcome):
+            self.reward_sums[i] += r
+
+    def p1_win_rate(self):
+        return self.p1_wins / self.num_games
+
+    def games_per_second(self):
+        return self.num_games / self.elapsed
+
+    def report(self):
+        report_win_rate(self.p1_wins, self.num_games)
+        if self.elapsed > 0:
+            print(f"  Games/sec: {round(self.games_per_second())}")
+            print()
+
+
+def report_win_rate(p1_wins, N):
+    p = p1_wins / N
+    p1_wins_std = math.sqrt(N * p * (1 - p)) # Binomial distribution
+    error = p1_wins_std / N
+
+    print("\nResults")
+    print(f"  P1 games won: {p1_wins} / {N}")
+    print(f"  +/-: {round(p1_wins_std, 1)}")
+    print()
+    print(f"  P1 win rate: {round(p, 2)}")
+    print(f"  +/-: {round(error, 4)}")
+    print()
+
+
+def spawn_seeds(master_seed: int, n: int) -> List[int]:
+    '''
+    Derive :n independent seeds from :master_seed.
+
+    Seeds are always >= 1 because Environment.set_up asserts a truthy
+    random_seed.
+    '''
+    seed_seqs = numpy.random.SeedSequence(master_seed).spawn(n)
+    return [int(s.generate_state(1)[0]) % 100_000_000 + 1 for s in seed_seqs]
+
+
+def play_games(
+    Game,
+    agent_builders: Sequence[Any],
+    num_games: int,
+    seed: int,
+    run_context: str = RunContexts.EVALUATION,
+) -> BatchResult:
+    '''
+    Play :num_games games in this process.
+
+    Each game gets its own seed drawn from a generator seeded with
+    :seed. Agents are built once and reused across games, the same way
+    play.random_win_rate does it.
+    '''
+    SETTINGS.disable_output()
+    seed_rng = random.Random(seed)
+    agents = [
+        builder.build(env_type=Game.NAME, run_context=run_context)
+        for builder in agent_builders
+    ]
+
+    result = BatchResult()
+    start = time.time()
+    for _ in range(num_games):
+        game = Game()
+        game.initialize(
+            agents,
+            seed=seed_rng.randint(1, 100_000_000),
+        )
+        outcome = game.run()
+        result.add_outcome(outcome)
+    result.elapsed = time.time() - start
+    return result
+
+
+def _play_games_worker(args):
+    return play_games(*args)
+
+
+def run_batch(
+    Game,
+    agent_builders: Sequence[Any],
+    num_games: int,
+    master_seed: Optional[int] = None,
+    num_workers: Optional[int] = None,
+    run_context: str = RunContexts.EVALUATION,
+) -> BatchResult:
+    '''
+    Play :num_games games of :Game over a pool of :num_workers processes
+    and merge the results.
+
+    :agent_builders are agent classes (anything with a .build(env_type=,
+    run_context=) classmethod); one is built per seat in every worker.
+    Both Game and the builders must be importable at module level so
+    they can be pickled to the workers.
+    '''
+    if num_games < 1:
+        raise ValueError(f"num_games must be >= 1, got {num_games}")
+    if master_seed is None:
+        master_seed = random.randint(0, 100_000_000)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, num_games))
+
+    # Split games as evenly as possible
+    # - First (num_games % num_workers) workers get one extra game
+    per_worker, extra = divmod(num_games, num_workers)
+    seeds = spawn_seeds(master_seed, num_workers)
+    jobs = []
+    for i, seed in enumerate(seeds):
+        n = per_worker + (1 if i < extra else 0)
+        jobs.append((Game, tuple(agent_builders), n, seed, run_context))
+
+    result = BatchResult()
+    start = time.time()
+    if num_workers == 1:
+        result.merge(play_games(*jobs[0]))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            for worker_result in pool.map(_play_games_worker, jobs):
+                result.merge(worker_result)
+    result.elapsed = time.time() - start
+    return result
@@ -0,0 +1,181 @@
+'''
+Batched LuckyGame engine.
+
+Holds B games as NumPy arrays and steps them all at once. It is meant
+for high-volume random playouts (win-rate estimates, self-play data),
+not for hosting games, so there are no events, agents or UI choices.
+
+Array layout (same meaning as luckygame.State):
+    boxes:        (B, 5) int8, column-major, 0 = unpicked, 1/2 = picked
+                  by P1/P2
+    prize:        (B,) int8, index of the prize box
+    acting_agent: (B,) int8, 0 or 1
+    done:         (B,) bool, game is terminal
+    winner:       (B,) int8, luckygame.State.winner() once done, else -1
+'''
+from dataclasses import dataclass, field
+from typing import (
+    Dict,
+    Optional,
+    Sequence,
+)
+import numpy
+
+NUM_BOXES = 5
+NUM_AGENTS = 2
+
+
+@dataclass
+class BatchedLuckyGame:
+    batch_size: int
+    seed: Optional[int] = None
+
+    rng: numpy.random.Generator = field(init=False)
+    boxes: numpy.ndarray = field(init=False)
+    prize: numpy.ndarray = field(init=False)
+    acting_agent: numpy.ndarray = field(init=False)
+    done: numpy.ndarray = field(init=False)
+    winner: numpy.ndarray = field(init=False)
+    num_moves: numpy.ndarray = field(init=False)
+
+    def __post_init__(self):
+        self.rng = numpy.random.default_rng(self.seed)
+        self.reset()
+
+    @classmethod
+    def from_states(cls, states: Sequence, seed=None):
+        '''
+        Build a batch from luckygame.State objects, e.g., to play out
+        many search leaves in one call.
+        '''
+        batch = cls(len(states), seed=seed)
+        for i, state in enumerate(states):
+            batch.boxes[i] = state.boxes
+            batch.prize[i] = state.prize
+            batch.acting_agent[i] = state.acting_agent
+        batch.update_terminal()
+        return batch
+
+    def reset(self):
+        '''
+        Start B new games, drawn like luckygame.Environment.initial_state
+        '''
+        B = self.batch_size
+        rng = self.rng
+        # Column-major so each box column is contiguous
+        self.boxes = numpy.zeros((B, NUM_BOXES), dtype=numpy.int8, order="F")
+        self.prize = rng.integers(0, NUM_BOXES, size=B, dtype=numpy.int8)
+        self.acting_agent = rng.integers(0, NUM_AGENTS, size=B, dtype=numpy.int8)
+        self.done = numpy.zeros(B, dtype=bool)
+        self.winner = numpy.full(B, -1, dtype=numpy.int8)
+        self.num_moves = numpy.zeros(B, dtype=numpy.int16)
+
+    def eligible_mask(self) -> numpy.ndarray:
+        '''
+        (B, 5) bool mask of legal actions. Rows of finished games are
+        all False.
+        '''
+        return (self.boxes == 0) & ~self.done[:, None]
+
+    def step(self, actions: numpy.ndarray):
+        '''
+        Apply one action per game. Entries for finished games are
+        ignored.
+        '''
+        active = ~self.done
+        idx = numpy.flatnonzero(active)
+        flat_boxes = self.boxes.reshape(-1, order="F") # view, column-major
+        flat_idx = actions[idx].astype(numpy.intp) * self.batch_size + idx
+        flat_boxes[flat_idx] = self.acting_agent[idx] + 1
+        self.acting_agent ^= active
+        self.num_moves += active
+        self.update_terminal()
+
+    def random_actions(self) -> numpy.ndarray:
+        '''
+        Pick a uniformly random eligible box for every game.
+
+        Draw r in [0, num_eligible) and take the (r+1)-th eligible box.
+        With only 5 boxes it is much faster to loop over the (column
+        contiguous) box columns than to reduce along axis 1. Finished
+        games get action 0, which step ignores.
+        '''
+        B = self.batch_size
+        cols = [self.boxes[:, i] == 0 for i in range(NUM_BOXES)]
+        counts = numpy.zeros(B, dtype=numpy.int8)
+        for col in cols:
+            counts += col
+        r = (self.rng.random(B, dtype=numpy.float32) * counts).astype(numpy.int8)
+
+        # Count eligible boxes seen so far; the action is the number of
+        # boxes passed before the running count exceeds r.
+        actions = numpy.zeros(B, dtype=numpy.int8)
+        seen = numpy.zeros(B, dtype=numpy.int8)
+        for col in cols[:-1]:
+            seen += col
+            actions += seen <= r
+        actions[self.done] = 0
+        return actions
+
+    def step_random(self):
+        self.step(self.random_actions())
+
+    def update_terminal(self):
+        # Same rule as luckygame.State.winner: once the prize box is
+        # picked, the winner is whoever holds the box to its left
+        # (wrapping around like a negative list index).
+        B = self.batch_size
+        rows = numpy.arange(B)
+        prize = self.prize.astype(numpy.intp)
+        flat_boxes = self.boxes.reshape(-1, order="F")
+        prize_box = flat_boxes.take(prize * B + rows)
+        left_box = flat_boxes.take((prize - 1) % NUM_BOXES * B + rows)
+        newly_done = (prize_box != 0) & ~self.done
+        numpy.copyto(self.winner, left_box, where=newly_done)
+        self.done |= newly_done
+
+    def rewards(self) -> numpy.ndarray:
+        '''
+        (B, 2) float32 rewards, matching luckygame.State.rewards: zero
+        for unfinished games, +1 for the winner and -1 for the loser.
+        '''
+        rewards = numpy.zeros((self.batch_size, NUM_AGENTS), dtype=numpy.float32)
+        idx = numpy.flatnonzero(self.done)
+        rewards[idx] = -1.0
+        winning_agent = (self.winner[idx].astype(numpy.int64) - 1) % NUM_AGENTS
+        rewards[idx, winning_agent] = 1.0
+        return rewards
+
+    def run_random(self) -> numpy.ndarray:
+        '''
+        Play every game to the end with uniformly random actions and
+        return the rewards.
+
+        Every LuckyGame ends within 5 moves (the prize box is picked at
+        the latest on the last one), so this loops at most 5 times.
+        '''
+        while not self.done.all():
+            self.step_random()
+        return self.rewards()
+
+
+def simulate_random(num_games, batch_size=100_000, seed=None) -> Dict:
+    '''
+    Play :num_games random games in batches and summarize the outcomes
+    '''
+    rng = numpy.random.default_rng(seed)
+    p1_wins = 0
+    length_counts = numpy.zeros(NUM_BOXES + 1, dtype=numpy.int64)
+    played = 0
+    while played < num_games:
+        B = min(batch_size, num_games - played)
+        batch = BatchedLuckyGame(B, seed=int(rng.integers(2**63)))
+        rewards = batch.run_random()
+        p1_wins += int((rewards[:, 0] > 0).sum())
+        length_counts += numpy.bincount(batch.num_moves, minlength=NUM_BOXES + 1)
+        played += B
+    return dict(
+        num_games=played,
+        p1_wins=p1_wins,
+        length_counts=length_counts,
+    )
@@ -0,0 +1,817 @@
+'''
+Benchmarks and sanity checks for the hot paths.
+
+Run all of them:
+    python benchmarks.py
+
+Or a subset by name:
+    python benchmarks.py batched_luckygame luckygame_parity
+'''
+import copy
+from dataclasses import (
+    fields,
+    make_dataclass,
+)
+import math
+import random
+import sys
+import time
+import tracemalloc
+
+from timing import (
+    Timer,
+    format_count,
+    format_rate,
+)
+from settings import SETTINGS
+from base_environment import Event
+from random_agent import Agent as RandomAgent
+from luckygame import Environment as LuckyGame
+from gatherer import (
+    ACTIONS,
+    ACTION_HANDLERS,
+    Environment as Gatherer,
+)
+from static_assets import STATIC_DIR
+from batched_luckygame import (
+    NUM_BOXES,
+    simulate_random,
+)
+
+
+def play_random_luckygames(N, seed=1):
+    '''
+    Play :N LuckyGames through Environment.run with random agents.
+    '''
+    SETTINGS.disable_output()
+    agents = [
+        RandomAgent.build(),
+        RandomAgent.build(),
+    ]
+    p1_wins = 0
+    length_counts = [0] * (NUM_BOXES + 1)
+    for i in range(N):
+        game = LuckyGame()
+        game.initialize(agents, seed=seed + i)
+        outcome = game.run()
+        if outcome[0] > 0:
+            p1_wins += 1
+        length_counts[game.action_number() - 1] += 1
+    return dict(
+        num_games=N,
+        p1_wins=p1_wins,
+        length_counts=length_counts,
+    )
+
+
+def bench_batched_luckygame(num_games=2_000_000, batch_size=100_000):
+    with Timer() as t:
+        simulate_random(num_games, batch_size=batch_size, seed=1)
+    print(f"batched_luckygame B={format_count(batch_size)}")
+    print(f"  games/sec: {format_rate(t.rate(num_games))}")
+
+    N = 20_000
+    with Timer() as t:
+        play_random_luckygames(N)
+    print("Environment.run")
+    print(f"  games/sec: {format_rate(t.rate(N))}")
+
+
+def check_luckygame_parity(num_env_games=20_000, num_batched_games=1_000_000):
+    '''
+    Batched engine and Environment.run should produce the same
+    distribution of (P1 win, game length). Every frequency must agree
+    within 4 standard errors.
+    '''
+    env = play_random_luckygames(num_env_games)
+    batched = simulate_random(num_batched_games, seed=1)
+
+    def compare(name, k_env, k_batched):
+        n1, n2 = env["num_games"], batched["num_games"]
+        p1, p2 = k_env / n1, k_batched / n2
+        p = (k_env + k_batched) / (n1 + n2)
+        se = math.sqrt(p * (1 - p) * (1 / n1 + 1 / n2)) or 1e-12
+        z = (p1 - p2) / se
+        print(f"  {name:<12} env:{p1:.4f} batched:{p2:.4f} z:{z:+.2f}")
+        assert abs(z) < 4.0, f"{name} distributions differ"
+
+    print("luckygame_parity")
+    compare("P1 win", env["p1_wins"], batched["p1_wins"])
+    for length in range(1, NUM_BOXES + 1):
+        compare(
+            f"length {length}",
+            env["length_counts"][length],
+            int(batched["length_counts"][length]),
+        )
+
+
+def bench_state_keys(N=100_000):
+    '''
+    Encode/decode/hash throughput of State.to_state_key and
+    State.from_state_key.
+    '''
+    lucky = LuckyGame()
+    lucky.set_seed(1)
+    lucky_state = lucky.initial_state()
+    lucky_state = lucky.transition(lucky_state, lucky_state.eligible_actions()[0])
+
+    gatherer = Gatherer()
+    gatherer.set_seed(1)
+    gatherer_state = gatherer.initial_state()
+
+    for name, state in (("luckygame", lucky_state), ("gatherer", gatherer_state)):
+        State = type(state)
+        key = state.to_state_key()
+        assert State.from_state_key(key).to_state_key() == key
+
+        with Timer() as encode_t:
+            for _ in range(N):
+                state.to_state_key()
+        with Timer() as decode_t:
+            for _ in range(N):
+                State.from_state_key(key)
+        with Timer() as hash_t:
+            for _ in range(N):
+                hash(key)
+
+        size = "int" if isinstance(key, int) else f"{len(key)} bytes"
+        print(f"state_keys {name} ({size})")
+        print(f"  encode/sec: {format_rate(encode_t.rate(N))}")
+        print(f"  decode/sec: {format_rate(decode_t.rate(N))}")
+        print(f"  hash/sec: {format_rate(hash_t.rate(N))}")
+
+
+def gatherer_transitions(num_games=200, seed=1):
+    '''
+    (state, action) pairs from random Gatherer games
+    '''
+    SETTINGS.disable_output()
+    pairs = []
+    for i in range(num_games):
+        env = Gatherer()
+        env.initialize([RandomAgent.build()], seed=seed + i)
+        env.run()
+        for prev_event, event in zip(env.event_history, env.event_history[1:]):
+            pairs.append((prev_event.state, event.action))
+    return env, pairs
+
+
+def deepcopy_transition(state, action):
+    # Baseline: what State.copy would cost as a deepcopy
+    rstate = copy.deepcopy(state)
+    kind, args = ACTIONS[action]
+    ACTION_HANDLERS[kind](rstate, *args)
+    return rstate
+
+
+def bench_gatherer_copy(num_games=200):
+    '''
+    Time and memory per Gatherer transition, structurally shared
+    State.copy vs a deepcopy baseline. Memory is what's still allocated
+    per transition while every resulting state is kept alive.
+    '''
+    env, pairs = gatherer_transitions(num_games)
+    N = len(pairs)
+    for name, transition in (
+        ("State.copy", env.transition),
+        ("deepcopy", deepcopy_transition),
+    ):
+        with Timer() as t:
+            for state, action in pairs:
+                transition(state, action)
+
+        tracemalloc.start()
+        before_size, _ = tracemalloc.get_traced_memory()
+        before_blocks = sys.getallocatedblocks()
+        kept = [transition(state, action) for state, action in pairs]
+        blocks = sys.getallocatedblocks() - before_blocks
+        size = tracemalloc.get_traced_memory()[0] - before_size
+        tracemalloc.stop()
+        del kept
+
+        print(f"gatherer_copy {name} ({format_count(N)} transitions)")
+        print(f"  transitions/sec: {format_rate(t.rate(N))}")
+        print(f"  usec/transition: {round(1e6 * t.interval / N, 2)}")
+        print(f"  blocks/transition: {round(blocks / N, 1)}")
+        print(f"  bytes/transition: {round(size / N)}")
+
+
+def bench_gatherer_board_memory(N=10_000):
+    '''
+    Bytes per Gatherer board: the array representation (resources array
+    + face_up bitmask, cards shared) vs an equivalent List[List[Cell]].
+    '''
+    env = Gatherer()
+    env.set_seed(1)
+    state = env.initial_state()
+
+    def object_board():
+        return [[state.cell(row, col) for col in range(4)] for row in range(4)]
+
+    def array_board():
+        return (state.resources.copy(), state.face_up)
+
+    for name, build in (("List[List[Cell]]", object_board), ("arrays", array_board)):
+        tracemalloc.start()
+        with Timer() as t:
+            kept = [build() for _ in range(N)]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        print(f"gatherer_board_memory {name}")
+        print(f"  bytes/board: {round(size / N)}")
+        print(f"  boards/sec: {format_rate(t.rate(N))}")
+
+
+def transition_rollout(env, state, rng):
+    while not state.is_terminal():
+        state = env.transition(state, rng.choice(state.eligible_actions()))
+    return state.rewards()
+
+
+def apply_rollout(env, state, rng):
+    # Walk forward in place, then back to the starting state
+    tokens = []
+    while not state.is_terminal():
+        tokens.append(env.apply(state, rng.choice(state.eligible_actions())))
+    rewards = state.rewards()
+    for token in reversed(tokens):
+        env.undo(state, token)
+    return rewards
+
+
+def bench_apply_undo(N=20_000):
+    '''
+    Random rollouts/sec from an initial state, copying
+    Environment.transition vs in-place Environment.apply/undo. Also
+    checks both walk through the same states and that undo restores
+    the root exactly.
+    '''
+    for name, Game in (("luckygame", LuckyGame), ("gatherer", Gatherer)):
+        env = Game()
+        env.set_seed(1)
+        root = env.initial_state()
+        if Game is Gatherer:
+            root = env.transition(root, root.eligible_actions()[0])
+        root_key = root.to_state_key()
+
+        # Same actions -> same states
+        check_rng = random.Random(1)
+        state, in_place = root, root.copy()
+        for _ in range(200):
+            if state.is_terminal():
+                state, in_place = root, root.copy()
+            action = check_rng.choice(state.eligible_actions())
+            state = env.transition(state, action)
+            env.apply(in_place, action)
+            assert in_place.to_state_key() == state.to_state_key()
+            assert in_place.eligible_actions() == state.eligible_actions()
+
+        print(f"apply_undo {name} ({format_count(N)} rollouts)")
+        for mode, rollout, start in (
+            ("transition", transition_rollout, root),
+            ("apply/undo", apply_rollout, root.copy()),
+        ):
+            rng = random.Random(1)
+            with Timer() as t:
+                for _ in range(N):
+                    rollout(env, start, rng)
+            assert start.to_state_key() == root_key
+            print(f"  {mode} rollouts/sec: {format_rate(t.rate(N))}")
+
+
+def bench_rollout(N=20_000):
+    '''
+    Random games/sec through Environment.run (random agents) vs the
+    headless Environment.rollout. Random agents draw from env.rng just
+    like the default rollout policy, so a seeded game must end the same
+    way either way.
+    '''
+    SETTINGS.disable_output()
+    for name, Game in (("luckygame", LuckyGame), ("gatherer", Gatherer)):
+        agents = [RandomAgent.build() for _ in range(2 if Game is LuckyGame else 1)]
+        for seed in range(1, 201):
+            env = Game()
+            env.initialize(agents, seed=seed)
+            outcome = env.rollout(env.current_state())
+            env = Game()
+            env.initialize(agents, seed=seed)
+            assert env.run() == outcome
+
+        with Timer() as run_t:
+            for i in range(N):
+                env = Game()
+                env.initialize(agents, seed=i + 1)
+                env.run()
+
+        env = Game()
+        env.set_seed(1)
+        with Timer() as rollout_t:
+            for _ in range(N):
+                env.rollout(env.initial_state())
+
+        print(f"rollout {name} ({format_count(N)} games)")
+        print(f"  run games/sec: {format_rate(run_t.rate(N))}")
+        print(f"  rollout games/sec: {format_rate(rollout_t.rate(N))}")
+
+
+def plain_twin(cls):
+    '''
+    The same fields as dataclass :cls, without slots (i.e., with a
+    per-instance __dict__, like the classes were before)
+    '''
+    return make_dataclass(
+        f"Plain{cls.__name__}",
+        [(f.name, f.type) for f in fields(cls)],
+    )
+
+
+def bench_state_memory(N=100_000):
+    '''
+    Bytes per instance and instances/sec, slotted classes vs plain
+    dataclass twins. Field values are shared, so this is the per-object
+    overhead that slots remove.
+    '''
+    lucky = LuckyGame()
+    lucky.set_seed(1)
+    lucky_state = lucky.initial_state()
+    gatherer = Gatherer()
+    gatherer.set_seed(1)
+    gatherer_state = gatherer.initial_state()
+
+    samples = (
+        ("luckygame.State", lucky_state),
+        ("gatherer.State", gatherer_state),
+        ("gatherer.Cell", gatherer_state.cell(0, 0)),
+        ("Event", Event(action=0, state=lucky_state)),
+    )
+    for name, sample in samples:
+        Slotted = type(sample)
+        Plain = plain_twin(Slotted)
+        values = {f.name: getattr(sample, f.name) for f in fields(Slotted)}
+        init_values = {f.name: values[f.name] for f in fields(Slotted) if f.init}
+
+        print(f"state_memory {name}")
+        for label, build, kwargs in (
+            ("plain", Plain, values),
+            ("slots", Slotted, init_values),
+        ):
+            tracemalloc.start()
+            with Timer() as t:
+                kept = [build(**kwargs) for _ in range(N)]
+            size, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del kept
+            # Less the list holding them
+            per_instance = (size - sys.getsizeof([None] * N)) / N
+            print(f"  {label} bytes/instance: {round(per_instance)}")
+            print(f"  {label} instances/sec: {format_rate(t.rate(N))}")
+
+
+def old_report_every(loop_key, every_n=1000, elements_per_call=1, _loops={}):
+    # Baseline: timing.report_every as it used to be (time.time, the
+    # counter off by one, modulo trigger), minus the printing
+    loop_info = _loops.get(loop_key)
+    if loop_info is None:
+        loop_info = _loops[loop_key] = dict(start_time=time.time(), last_split_time=time.time(), counter=0)
+    loop_info["counter"] += 1
+    num_completed = (loop_info["counter"] + 1) * elements_per_call
+    if num_completed % every_n == 0:
+        now = time.time()
+        rate = num_completed / (now - loop_info["start_time"])
+        split_rate = every_n / (now - loop_info["last_split_time"])
+        loop_info["last_split_time"] = now
+        rate, split_rate
+    return num_completed
+
+
+def bench_report_every(N=1_000_000, every_n=10_000):
+    '''
+    Per-iteration cost of tracking a tight :N iteration loop with
+    report_every (not displaying) vs the old implementation and no
+    tracking, and a check of the counts/splits it reports
+    '''
+    from timing import (
+        loop_stats,
+        report_every,
+        reset_loop,
+    )
+
+    with Timer() as bare_t:
+        for _ in range(N):
+            pass
+    with Timer() as old_t:
+        for _ in range(N):
+            old_report_every("bench", every_n)
+    reset_loop("bench")
+    with Timer() as new_t:
+        for _ in range(N):
+            report_every("bench", every_n, display=False)
+    stats = loop_stats("bench")
+    assert stats["count"] == N
+    assert stats["num_splits"] == min(N // every_n, 100)
+
+    # Batched calls that don't land on multiples of every_n still split
+    reset_loop("batched")
+    for _ in range(N // 7):
+        report_every("batched", every_n, elements_per_call=7, display=False)
+    batched = loop_stats("batched")
+    assert batched["count"] == N // 7 * 7
+
+    print(f"report_every ({format_count(N)} iterations, every {format_count(every_n)})")
+    print(f"  bare loop ns/iteration: {round(1e9 * bare_t.interval / N, 1)}")
+    print(f"  old report_every ns/iteration: {round(1e9 * old_t.interval / N, 1)}")
+    print(f"  report_every ns/iteration: {round(1e9 * new_t.interval / N, 1)}")
+    print(f"  splits: {stats['num_splits']}, split p10/p50/p90 rates/sec: "
+          f"{format_rate(stats['split_p10'])} / {format_rate(stats['split_p50'])} / {format_rate(stats['split_p90'])}")
+    print(f"  elements_per_call=7 splits: {batched['num_splits']} (old trigger: "
+          f"{sum(1 for c in range(1, N // 7 + 1) if ((c + 1) * 7) % every_n == 0)})")
+
+
+def bench_profiling(N=20_000):
+    '''
+    LuckyGames/sec through Environment.run before profiling was ever
+    enabled, with it enabled, and after disabling it again, plus the
+    profiler's own view of the enabled run.
+    '''
+    import profiling
+
+    rates = {}
+    for name in ("never enabled", "enabled", "disabled"):
+        if name == "enabled":
+            profiling.enable()
+        with Timer() as t:
+            play_random_luckygames(N)
+        if name == "enabled":
+            profiling.disable()
+            snapshot = profiling.PROFILER.snapshot()
+        rates[name] = t.rate(N)
+
+    print(f"profiling luckygame ({format_count(N)} games)")
+    for name, rate in rates.items():
+        print(f"  {name} games/sec: {format_rate(rate)}")
+    print(f"  profiled games/sec: {format_rate(snapshot['games_per_second'])}")
+    print(f"  mean moves/game: {round(snapshot['moves_per_game']['mean'], 2)}")
+    print(f"  environment time fraction: {round(snapshot['environment_fraction'], 3)}")
+    for key, h in snapshot["calls"].items():
+        print(f"  {key}: {format_count(h['count'])} calls, mean {round(1e6 * h['mean'], 2)}us, p99 <= {round(1e6 * h['p99'])}us")
+
+
+def pop_front_set_up(env, replay_history):
+    # Baseline: Environment.set_up's replay as it used to be, popping
+    # events off the front and notifying agents one event at a time
+    env.event_history.append(replay_history.pop(0))
+    for agent in env.agents:
+        agent.set_up()
+    while replay_history:
+        event = replay_history.pop(0)
+        env.event_history.append(event)
+        for agent in env.agents:
+            agent.handle_event(event)
+
+
+def bench_replay(num_games=2_000, long_game_events=100_000):
+    '''
+    Game logs: writing/reading a JSONL log of :num_games random
+    Gatherer games and rebuilding them, then replaying one synthetic
+    :long_game_events event history, linear set_up vs the old pop(0)
+    replay.
+    '''
+    import os
+    import tempfile
+    from game_log import (
+        GameLog,
+        GameLogWriter,
+        read_game_logs,
+        resolve,
+    )
+
+    SETTINGS.disable_output()
+    logs = []
+    for i in range(num_games):
+        env = Gatherer()
+        env.initialize([RandomAgent.build()], seed=1 + i)
+        env.run()
+        logs.append(GameLog.from_env(env))
+    num_events = sum(len(log.events) for log in logs)
+
+    def old_restore(log):
+        Game = resolve(log.game)
+        env = Game()
+        env.set_seed(log.random_seed)
+        for agent_name in log.agents:
+            env.add_agent(resolve(agent_name).build())
+        pop_front_set_up(env, [Event.from_dict(dict(data), Game.STATE) for data in log.events])
+        return env
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "games.jsonl")
+        with Timer() as write_t:
+            with GameLogWriter(path) as writer:
+                for log in logs:
+                    writer.write(log)
+        with Timer() as read_t:
+            read_logs = list(read_game_logs(path))
+        print(f"replay game log ({format_count(num_games)} games, {format_count(num_events)} events)")
+        print(f"  bytes/event: {round(os.path.getsize(path) / num_events)}")
+        print(f"  write games/sec: {format_rate(write_t.rate(num_games))}")
+        print(f"  read games/sec: {format_rate(read_t.rate(num_games))}")
+
+    for name, restore in (
+        ("set_up", GameLog.restore),
+        ("pop(0) set_up", old_restore),
+    ):
+        with Timer() as t:
+            envs = [restore(log) for log in read_logs]
+        assert all(
+            env.current_state().to_state_key() == log.events[-1]["state"]
+            for env, log in zip(envs, read_logs)
+        )
+        print(f"  {name} restores/sec: {format_rate(t.rate(num_games))}")
+
+    # Replay cost vs length
+    # - Events don't have to be consistent to time the replay itself
+    env = Gatherer()
+    env.initialize([RandomAgent.build()], seed=1)
+    env.run()
+    history = env.event_history
+    events = [history[i % len(history)] for i in range(long_game_events)]
+    print(f"replay synthetic history ({format_count(long_game_events)} events)")
+    for name, set_up in (
+        ("set_up", lambda env, events: env.set_up(replay_history=events)),
+        ("pop(0) set_up", pop_front_set_up),
+    ):
+        env = Gatherer()
+        env.set_seed(1)
+        env.add_agent(RandomAgent.build())
+        with Timer() as t:
+            set_up(env, list(events))
+        print(f"  {name} seconds: {round(t.interval, 3)}")
+
+
+def uncached_static_app():
+    '''
+    Flask app serving static files the way gameserver used to: read
+    from disk on every request, no caching headers
+    '''
+    from flask import Flask, Response
+    app = Flask("uncached_static")
+
+    @app.route("/<filename>.js")
+    def static_js(filename):
+        body = open(f"{STATIC_DIR}/{filename}.js", "r").read()
+        return Response(body, mimetype="text/javascript")
+
+    @app.route("/")
+    def index():
+        return open(f"{STATIC_DIR}/index.html", "r").read()
+
+    return app
+
+
+def bench_static_assets(N=5_000):
+    '''
+    / and /app.js, reading the file per request vs the StaticAssets
+    cache, for full responses (gzip accepted) and revalidations
+    (If-None-Match -> 304). Requests/sec is end to end through the
+    Flask test client (whose own overhead dominates); handler usec
+    times just the view inside a request context.
+    '''
+    import gameserver
+    gzip_headers = {"Accept-Encoding": "gzip"}
+    for path in ("/", "/app.js"):
+        etag = gameserver.app.test_client().get(path, headers=gzip_headers).headers["ETag"]
+        print(f"static_assets {path}")
+        for name, app, headers in (
+            ("uncached", uncached_static_app(), gzip_headers),
+            ("cached", gameserver.app, gzip_headers),
+            ("cached 304", gameserver.app, dict(gzip_headers, **{"If-None-Match": etag})),
+        ):
+            client = app.test_client()
+            with Timer() as t:
+                for _ in range(N):
+                    response = client.get(path, headers=headers)
+
+            with app.test_request_context(path, headers=headers) as context:
+                view = app.view_functions[context.request.url_rule.endpoint]
+                view_args = context.request.view_args
+                with Timer() as view_t:
+                    for _ in range(N):
+                        app.make_response(view(**view_args))
+
+            print(f"  {name} ({len(response.data)} bytes)")
+            print(f"    requests/sec: {format_rate(t.rate(N))}")
+            print(f"    handler usec: {round(1e6 * view_t.interval / N, 1)}")
+
+
+def serve_gameserver(port, db_path):
+    # Worker process: one gameserver on :port sharing :db_path
+    import logging
+    import os
+    from werkzeug.serving import make_server
+    if db_path:
+        os.environ["GAMESERVER_DB"] = db_path
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    import gameserver
+    make_server("127.0.0.1", port, gameserver.app, threaded=True).serve_forever()
+
+
+def play_hosted_game(urls, rng):
+    '''
+    Play one LuckyGame as the client against the hosted random bot,
+    sending every request to a random worker in :urls.
+    '''
+    import json
+    import urllib.request
+
+    def call(path, data=None):
+        url = rng.choice(urls) + path
+        body = json.dumps(data).encode() if data is not None else None
+        with urllib.request.urlopen(url, data=body) as response:
+            return json.loads(response.read())
+
+    game_id = call("/new_game")["gameId"]
+    cursor = 0
+    boxes = None
+    while True:
+        # Wait for the client's turn: the game must be past our last
+        # move (another worker may not have seen it yet) and idle
+        updates = call("/game_updates", {"gameId": game_id, "since": cursor, "wait": 5})
+        if updates["gameOver"]:
+            return
+        if updates["gameHistory"]:
+            boxes = updates["gameHistory"][-1]["boxes"]
+        cursor = updates["cursor"]
+        if not updates["awaitingClient"]:
+            continue
+        action = rng.choice([i for i, box in enumerate(boxes) if box == 0])
+        call("/submit_action", {"gameId": game_id, "action": action})
+        cursor += 1
+
+
+def bench_gameserver_workers(num_games=200, num_clients=8, worker_counts=(1, 2, 4)):
+    '''
+    Hosted games/sec with N gameserver worker processes sharing a
+    SQLite game store, :num_clients concurrent clients, each request
+    going to a random worker (so games constantly move between workers
+    and get rebuilt from the stored event log). The first row is one
+    worker with the in-process store for reference.
+    '''
+    import multiprocessing
+    import os
+    import socket
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    def free_port():
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    ctx = multiprocessing.get_context("spawn")
+    configs = [(1, False)] + [(n, True) for n in worker_counts]
+    for num_workers, shared in configs:
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "games.sqlite") if shared else None
+            if shared:
+                # Create the schema before the workers race to
+                from game_store import SQLiteBackend
+                SQLiteBackend(db_path)
+            ports = [free_port() for _ in range(num_workers)]
+            workers = [
+                ctx.Process(target=serve_gameserver, args=(port, db_path), daemon=True)
+                for port in ports
+            ]
+            for worker in workers:
+                worker.start()
+            urls = [f"http://127.0.0.1:{port}" for port in ports]
+            for port in ports:
+                while True:
+                    try:
+                        socket.create_connection(("127.0.0.1", port)).close()
+                        break
+                    except OSError:
+                        time.sleep(0.05)
+
+            def client(i):
+                rng = random.Random(i)
+                for _ in range(num_games // num_clients):
+                    play_hosted_game(urls, rng)
+
+            with Timer() as t:
+                with ThreadPoolExecutor(num_clients) as pool:
+                    list(pool.map(client, range(num_clients)))
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+
+        store = "sqlite" if shared else "in-process"
+        played = num_games // num_clients * num_clients
+        print(f"gameserver_workers {num_workers} worker(s), {store} store")
+        print(f"  games/sec: {format_rate(t.rate(played))}")
+
+
+def play_bulk_games(url, num_games, rng, batch_size=100):
+    '''
+    Play :num_games LuckyGames as the client against the hosted random
+    bot through the bulk endpoints: create them :batch_size at a time,
+    then move in every unfinished game with one request per round.
+    '''
+    import json
+    import urllib.request
+
+    def call(path, data):
+        body = json.dumps(data).encode()
+        with urllib.request.urlopen(url + path, data=body) as response:
+            return json.loads(response.read())
+
+    for start in range(0, num_games, batch_size):
+        count = min(batch_size, num_games - start)
+        game_ids = call("/new_games", {"count": count})["gameIds"]
+
+        # gameId -> [cursor, boxes, awaiting client]
+        games = {game_id: [0, None, False] for game_id in game_ids}
+        while games:
+            moves = []
+            for game_id, (cursor, boxes, awaiting) in games.items():
+                move = {"gameId": game_id, "since": cursor, "action": None}
+                if awaiting:
+                    move["action"] = rng.choice([i for i, box in enumerate(boxes) if box == 0])
+                moves.append(move)
+            results = call("/submit_actions", {"moves": moves, "wait": 5})["results"]
+            for move, result in zip(moves, results):
+                game_id = move["gameId"]
+                if result["gameOver"]:
+                    del games[game_id]
+                    continue
+                game = games[game_id]
+                if result["gameHistory"]:
+                    game[1] = result["gameHistory"][-1]["boxes"]
+                game[0] = result["cursor"]
+                game[2] = result["awaitingClient"]
+
+
+def bench_bulk_api(num_games=400, num_clients=8):
+    '''
+    Hosted games/sec played through the one-game endpoints
+    (:num_clients concurrent clients) vs. one client using the bulk
+    endpoints, against an in-process gameserver.
+    '''
+    import socket
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    import gameserver
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = make_server("127.0.0.1", port, gameserver.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{port}"
+
+    def client(i):
+        rng = random.Random(i)
+        for _ in range(num_games // num_clients):
+            play_hosted_game([url], rng)
+
+    played = num_games // num_clients * num_clients
+    with Timer() as t:
+        with ThreadPoolExecutor(num_clients) as pool:
+            list(pool.map(client, range(num_clients)))
+    print(f"bulk_api single-game endpoints, {num_clients} clients")
+    print(f"  games/sec: {format_rate(t.rate(played))}")
+
+    for batch_size in (10, 100):
+        with Timer() as t:
+            play_bulk_games(url, played, random.Random(0), batch_size=batch_size)
+        print(f"bulk_api bulk endpoints, 1 client, {batch_size} games per batch")
+        print(f"  games/sec: {format_rate(t.rate(played))}")
+    server.shutdown()
+
+
+BENCHMARKS = {
+    "batched_luckygame": bench_batched_luckygame,
+    "luckygame_parity": check_luckygame_parity,
+    "state_keys": bench_state_keys,
+    "gatherer_copy": bench_gatherer_copy,
+    "gatherer_board_memory": bench_gatherer_board_memory,
+    "apply_undo": bench_apply_undo,
+    "rollout": bench_rollout,
+    "state_memory": bench_state_memory,
+    "replay": bench_replay,
+    "profiling": bench_profiling,
+    "report_every": bench_report_every,
+    "static_assets": bench_static_assets,
+    "gameserver_workers": bench_gameserver_workers,
+    "bulk_api": bench_bulk_api,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+        print()
@@ -16,6 +16,9 @@ class Agent(BaseAgent):
     def handle_event(self, event):
         pass
 
+    def catch_up(self, events):
+        pass
+
     def select_action(self) -> Action:
         raise RuntimeError("Remote agents should never select actions")
 
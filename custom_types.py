@@ -20,7 +20,8 @@ Value = float
 Values = List[float]
 Policy = List[float] # could be probability (sum to 1)
 Rewards = List[float]
-StateKey = str # or tuple?
+StateKey = Union[int, bytes] # Compact, hashable, round-trips exactly
+UndoToken = Any # Opaque, from Environment.apply
 Outcome = Rewards
 
 # Model specific
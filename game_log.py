@@ -0,0 +1,169 @@
+'''
+Game logs: whole games as plain data, and a JSONL file format for them.
+
+A log file holds any number of games, one after another. Each game is
+a header line followed by one line per event (Event.to_dict records,
+i.e., state keys; the first event is the initial state):
+
+    {"game": "luckygame.Environment", "agents": [...], "random_seed": 7, "num_events": 3}
+    {"action": null, "rewards": [0, 0], "state": 0}
+    {"action": 2, "rewards": [0, 0], "state": 18}
+    ...
+
+Files are read one game at a time, so a log of millions of games never
+has to fit in memory, and a game is rebuilt with one linear pass over
+its events (see Environment.set_up).
+
+Usage:
+    with GameLogWriter(path) as writer:
+        writer.write(GameLog.from_env(env))
+
+    for log in read_game_logs(path):
+        env = log.restore()
+'''
+import base64
+from dataclasses import dataclass
+import importlib
+import itertools
+import json
+import sys
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+)
+
+from base_environment import Event
+
+
+def qualified_name(cls) -> str:
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def resolve(name):
+    '''
+    Class from its qualified_name
+    '''
+    module_name, _, attr = name.rpartition(".")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def encode_event(data: Dict) -> str:
+    '''
+    JSON for an Event.to_dict record. bytes state keys are base64'd.
+    '''
+    state = data["state"]
+    if isinstance(state, bytes):
+        data = dict(data, state=None, state_b64=base64.b64encode(state).decode())
+    return json.dumps(data)
+
+
+def decode_event(line: str) -> Dict:
+    data = json.loads(line)
+    state_b64 = data.pop("state_b64", None)
+    if state_b64 is not None:
+        data["state"] = base64.b64decode(state_b64)
+    return data
+
+
+@dataclass
+class GameLog:
+    '''
+    A game as plain data: environment and agent classes (by qualified
+    name), the seed and the Event.to_dict log
+    '''
+    game: str
+    agents: List[str]
+    random_seed: int
+    events: List[Dict]
+
+    @classmethod
+    def from_env(cls, env):
+        return cls(
+            game=qualified_name(type(env)),
+            agents=[qualified_name(type(agent)) for agent in env.agents],
+            random_seed=env.random_seed,
+            events=[event.to_dict() for event in env.event_history],
+        )
+
+    def header(self) -> Dict:
+        return dict(game=self.game, agents=self.agents, random_seed=self.random_seed)
+
+    def restore(self):
+        '''
+        Rebuild the environment by replaying the event log. Agents are
+        rebuilt with their default settings.
+        '''
+        Game = resolve(self.game)
+        env = Game()
+        env.set_seed(self.random_seed)
+        for agent_name in self.agents:
+            env.add_agent(resolve(agent_name).build())
+        env.set_up(replay_history=(
+            Event.from_dict(dict(data), Game.STATE)
+            for data in self.events
+        ))
+        return env
+
+    def to_lines(self) -> Iterator[str]:
+        yield json.dumps(dict(self.header(), num_events=len(self.events)))
+        for data in self.events:
+            yield encode_event(data)
+
+    def nbytes(self) -> int:
+        '''
+        Approximate size of the event log
+        '''
+        size = sys.getsizeof(self.events)
+        for data in self.events:
+            size += sys.getsizeof(data)
+            for value in data.values():
+                size += sys.getsizeof(value)
+        return size
+
+
+class GameLogWriter:
+    '''
+    Appends GameLogs to a JSONL log file (see module docstring)
+    '''
+
+    def __init__(self, path, mode="a"):
+        self.path = path
+        self.file = open(path, mode)
+        self.num_games = 0
+
+    def write(self, log: GameLog):
+        self.file.write("\n".join(log.to_lines()))
+        self.file.write("\n")
+        self.num_games += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_game_logs(lines: Iterable[str]) -> Iterator[GameLog]:
+    '''
+    GameLogs from the lines of a log file, one game at a time
+    '''
+    lines = iter(lines)
+    for header_line in lines:
+        if not header_line.strip():
+            continue
+        header = json.loads(header_line)
+        num_events = header.pop("num_events")
+        events = [decode_event(line) for line in itertools.islice(lines, num_events)]
+        if len(events) != num_events:
+            raise ValueError(f"Truncated game log: {len(events)} of {num_events} events")
+        yield GameLog(**header, events=events)
+
+
+def read_game_logs(path) -> Iterator[GameLog]:
+    with open(path) as f:
+        yield from parse_game_logs(f)
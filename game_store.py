@@ -0,0 +1,467 @@
+'''
+Bounded store for hosted games, optionally backed by shared storage.
+
+Games are kept in LRU order and evicted when the store is full or when
+they've been idle longer than :ttl. Finished games are compacted to
+their event log (a game_log.GameLog of Event.to_dict records, i.e.,
+state keys) and rebuilt with Environment.set_up(replay_history=...) when they are
+asked for again.
+
+With a :backend (e.g., SQLiteBackend), every event is also written to
+shared storage as it happens, so any worker process can rebuild a game
+it hasn't seen (or has a stale copy of) and continue it. The local
+entries are then just a cache.
+
+Usage:
+    store = GameStore(make_game=HostedGame, backend=SQLiteBackend(path))
+    store.add(game_id, HostedGame(env))
+    game = store.get(game_id)
+
+Games handed to the store must have an .env, an is_busy() that says
+whether something is still advancing the game (busy games are never
+evicted or expired), and a can_compact() that says whether it's
+finished and not busy.
+'''
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import json
+import logging
+import resource
+import sqlite3
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+)
+
+from game_log import (
+    GameLog,
+    decode_event,
+    encode_event,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class GameBackend(ABC):
+    '''
+    Shared storage of GameLogs by game id. Events are append-only and
+    numbered from 0, and an append that doesn't start right after the
+    stored events is rejected, so two workers can't both extend a game.
+    '''
+
+    @abstractmethod
+    def create(self, game_id, log: GameLog):
+        pass
+
+    @abstractmethod
+    def append_events(self, game_id, start: int, events: List[Dict]) -> bool:
+        '''
+        Store :events as events start, start + 1, ... Returns False
+        (and stores nothing) if the game doesn't have exactly :start
+        events.
+        '''
+        pass
+
+    @abstractmethod
+    def num_events(self, game_id) -> int:
+        '''
+        Raises KeyError for unknown games
+        '''
+        pass
+
+    @abstractmethod
+    def load(self, game_id) -> GameLog:
+        '''
+        Raises KeyError for unknown games
+        '''
+        pass
+
+    @abstractmethod
+    def delete_idle(self, max_idle: float) -> int:
+        '''
+        Delete games not appended to for :max_idle seconds and return
+        how many were deleted.
+        '''
+        pass
+
+
+@dataclass
+class MemoryBackend(GameBackend):
+    '''
+    In-process stand-in (a single worker only)
+    '''
+    logs: Dict[str, GameLog] = field(default_factory=dict)
+    updated: Dict[str, float] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def create(self, game_id, log):
+        with self.lock:
+            self.logs[game_id] = GameLog(**log.header(), events=list(log.events))
+            self.updated[game_id] = time.time()
+
+    def append_events(self, game_id, start, events):
+        with self.lock:
+            stored = self.logs[game_id].events
+            if len(stored) != start:
+                return False
+            stored.extend(events)
+            self.updated[game_id] = time.time()
+            return True
+
+    def num_events(self, game_id):
+        return len(self.logs[game_id].events)
+
+    def load(self, game_id):
+        with self.lock:
+            log = self.logs[game_id]
+            return GameLog(**log.header(), events=list(log.events))
+
+    def delete_idle(self, max_idle):
+        with self.lock:
+            cutoff = time.time() - max_idle
+            idle = [game_id for game_id, t in self.updated.items() if t < cutoff]
+            for game_id in idle:
+                del self.logs[game_id]
+                del self.updated[game_id]
+            return len(idle)
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    id TEXT PRIMARY KEY,
+    header TEXT NOT NULL,
+    num_events INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    game_id TEXT NOT NULL,
+    num INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (game_id, num)
+);
+CREATE INDEX IF NOT EXISTS games_updated ON games (updated);
+'''
+
+
+@dataclass
+class SQLiteBackend(GameBackend):
+    '''
+    Event logs in a SQLite file, shared by every worker process on the
+    host. Each thread gets its own connection. WAL mode lets readers
+    run while a worker appends.
+    '''
+    path: str
+    timeout: float = 30.0
+
+    local: threading.local = field(init=False, default_factory=threading.local)
+
+    def __post_init__(self):
+        connection = self.connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SQLITE_SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                isolation_level=None, # Explicit transactions below
+            )
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def create(self, game_id, log):
+        connection = self.connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT INTO games VALUES (?, ?, ?, ?)",
+                (game_id, json.dumps(log.header()), len(log.events), time.time()),
+            )
+            connection.executemany(
+                "INSERT INTO events VALUES (?, ?, ?)",
+                [(game_id, i, encode_event(data)) for i, data in enumerate(log.events)],
+            )
+
+    def append_events(self, game_id, start, events):
+        connection = self.connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if self.num_events(game_id) != start:
+                connection.execute("ROLLBACK")
+                return False
+            connection.executemany(
+                "INSERT INTO events VALUES (?, ?, ?)",
+                [(game_id, start + i, encode_event(data)) for i, data in enumerate(events)],
+            )
+            connection.execute(
+                "UPDATE games SET num_events = ?, updated = ? WHERE id = ?",
+                (start + len(events), time.time(), game_id),
+            )
+        return True
+
+    def num_events(self, game_id):
+        row = self.connection().execute(
+            "SELECT num_events FROM games WHERE id = ?",
+            (game_id,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(game_id)
+        return row[0]
+
+    def load(self, game_id):
+        connection = self.connection()
+        row = connection.execute(
+            "SELECT header FROM games WHERE id = ?",
+            (game_id,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(game_id)
+        events = [
+            decode_event(data)
+            for (data,) in connection.execute(
+                "SELECT data FROM events WHERE game_id = ? ORDER BY num",
+                (game_id,),
+            )
+        ]
+        return GameLog(**json.loads(row[0]), events=events)
+
+    def delete_idle(self, max_idle):
+        connection = self.connection()
+        cutoff = time.time() - max_idle
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "DELETE FROM events WHERE game_id IN (SELECT id FROM games WHERE updated < ?)",
+                (cutoff,),
+            )
+            deleted = connection.execute(
+                "DELETE FROM games WHERE updated < ?",
+                (cutoff,),
+            ).rowcount
+        return deleted
+
+
+@dataclass
+class StoreEntry:
+    game: Optional[Any] = None
+    compact: Optional[GameLog] = None
+    last_access: float = 0.0
+    persisted: int = 0 # Events written to the backend
+
+
+def current_rss() -> int:
+    '''
+    Resident set size of this process in bytes (peak RSS where the
+    current one isn't available)
+    '''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@dataclass
+class GameStore:
+    make_game: Callable # env -> hosted game, for restored games
+    max_games: int = 10_000
+    ttl: float = 3600.0 # seconds idle before a game is dropped
+    sweep_interval: float = 10.0
+    backend: Optional[GameBackend] = None
+
+    entries: "OrderedDict[str, StoreEntry]" = field(init=False, default_factory=OrderedDict)
+    lock: threading.RLock = field(init=False, default_factory=threading.RLock)
+    last_sweep: float = field(init=False, default=0.0)
+    evictions: int = field(init=False, default=0)
+    expirations: int = field(init=False, default=0)
+    compactions: int = field(init=False, default=0)
+    restores: int = field(init=False, default=0)
+    reloads: int = field(init=False, default=0)
+    conflicts: int = field(init=False, default=0)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, game_id):
+        return game_id in self.entries
+
+    def add(self, game_id, game):
+        with self.lock:
+            entry = StoreEntry(game=game, last_access=time.monotonic())
+            if self.backend is not None:
+                self.backend.create(game_id, GameLog.from_env(game.env))
+                entry.persisted = len(game.env.event_history)
+                self.watch(game_id, game)
+            self.insert(game_id, entry)
+
+    def insert(self, game_id, entry):
+        entries = self.entries
+        entries[game_id] = entry
+        entries.move_to_end(game_id)
+
+        # Evict least recently used games
+        # - Not ones still being advanced: a job would keep running on a
+        #   game the store no longer knows about.
+        if len(entries) > self.max_games:
+            for old_id, old_entry in list(entries.items()):
+                if len(entries) <= self.max_games:
+                    break
+                if old_id == game_id or self.is_busy(old_entry):
+                    continue
+                del entries[old_id]
+                self.evictions += 1
+        self.maybe_sweep()
+
+    def is_busy(self, entry) -> bool:
+        return entry.game is not None and entry.game.is_busy()
+
+    def watch(self, game_id, game):
+        '''
+        Write each new event of :game to the backend as it happens
+        (everything up to now must already be stored).
+
+        The write happens before the game's other listeners run, so
+        clients woken by an event can't get to another worker before
+        the event is stored. Writes go on even if the game has left
+        the local store.
+        '''
+        env = game.env
+        persisted = len(env.event_history)
+
+        def persist(event):
+            nonlocal persisted
+            with self.lock:
+                if persisted is None:
+                    return
+                entry = self.entries.get(game_id)
+                if entry is not None and entry.game is not game:
+                    entry = None
+                start = persisted
+                events = [e.to_dict() for e in env.event_history[start:]]
+                if self.backend.append_events(game_id, start, events):
+                    persisted = start + len(events)
+                    if entry is not None:
+                        entry.persisted = persisted
+                    return
+
+                # Another worker advanced this game first. Stop writing
+                # and drop the local copy; the next get reloads the
+                # stored one.
+                persisted = None
+                self.conflicts += 1
+                if entry is not None:
+                    del self.entries[game_id]
+                logger.warning("Game %s was advanced elsewhere; dropping local copy", game_id)
+
+        env.add_listener(persist, first=True)
+
+    def get(self, game_id):
+        '''
+        The live game: restored from its event log if it was compacted,
+        or (re)loaded from the backend if this worker doesn't have it
+        or another worker has advanced it. Raises KeyError for unknown
+        (or evicted) games.
+        '''
+        with self.lock:
+            entry = self.entries.get(game_id)
+            if self.backend is not None:
+                stored = self.backend.num_events(game_id)
+                local = entry.persisted if entry is not None else -1
+                if stored > local:
+                    if entry is not None:
+                        self.reloads += 1
+                    return self.load(game_id)
+            if entry is None:
+                raise KeyError(game_id)
+
+            entry.last_access = time.monotonic()
+            self.entries.move_to_end(game_id)
+            if entry.game is None:
+                entry.game = self.make_game(entry.compact.restore())
+                entry.compact = None
+                self.restores += 1
+            game = entry.game
+            self.maybe_sweep()
+            return game
+
+    def load(self, game_id):
+        log = self.backend.load(game_id)
+        game = self.make_game(log.restore())
+        entry = StoreEntry(
+            game=game,
+            last_access=time.monotonic(),
+            persisted=len(log.events),
+        )
+        self.watch(game_id, game)
+        self.insert(game_id, entry)
+        self.restores += 1
+        return game
+
+    def maybe_sweep(self):
+        if time.monotonic() - self.last_sweep >= self.sweep_interval:
+            self.sweep()
+
+    def sweep(self):
+        '''
+        Drop games idle longer than :ttl and compact finished ones.
+        With a backend, finished games are just dropped locally (the
+        backend has their log) and the backend deletes its idle games.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self.last_sweep = now
+            entries = self.entries
+
+            # LRU order, so the expired games are at the front
+            # - Busy games stay (see insert)
+            for game_id, entry in list(entries.items()):
+                if now - entry.last_access < self.ttl:
+                    break
+                if self.is_busy(entry):
+                    continue
+                del entries[game_id]
+                self.expirations += 1
+
+            for game_id, entry in list(entries.items()):
+                if entry.game is None or not entry.game.can_compact():
+                    continue
+                self.compactions += 1
+                if self.backend is not None:
+                    del entries[game_id]
+                    continue
+                entry.compact = GameLog.from_env(entry.game.env)
+                entry.game = None
+
+            if self.backend is not None:
+                self.backend.delete_idle(self.ttl)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            live = [e for e in self.entries.values() if e.game is not None]
+            compact = [e.compact for e in self.entries.values() if e.compact is not None]
+            return dict(
+                games=len(self.entries),
+                max_games=self.max_games,
+                live_games=len(live),
+                live_events=sum(len(e.game.env.event_history) for e in live),
+                compact_games=len(compact),
+                compact_events=sum(len(c.events) for c in compact),
+                compact_bytes=sum(c.nbytes() for c in compact),
+                evictions=self.evictions,
+                expirations=self.expirations,
+                compactions=self.compactions,
+                restores=self.restores,
+                reloads=self.reloads,
+                conflicts=self.conflicts,
+                backend=type(self.backend).__name__ if self.backend else None,
+                rss_bytes=current_rss(),
+            )
@@ -1,11 +1,22 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import json
+import os
+import threading
+import time
 from uuid import uuid4
 from typing import (
     Any,
-    Dict,
+    Deque,
+    List,
+    Optional,
+    Tuple,
 )
 from flask import (
     Flask,
     Response,
+    abort,
     request,
     jsonify,
 )
@@ -13,16 +24,254 @@ from flask import (
 from random_agent import Agent as RandomAgent
 from client_agent import Agent as ClientAgent
 from luckygame import Environment as LuckyGame
+from custom_types import JSONString
+from game_store import (
+    GameStore,
+    SQLiteBackend,
+)
+from static_assets import StaticAssets
+import profiling
 
 app = Flask(__name__)
 
 
-ACTIVE_GAMES: Dict[str, Any] = {}# guid, environment
+# How long a long-poll/stream waits for a new event before answering
+# empty (or sending a keep-alive)
+UPDATE_WAIT_TIMEOUT = 15.0
 
+# Bot moves run here, off the request threads (see HostedGame.submit)
+BOT_WORKERS = 4
+BOT_POOL = ThreadPoolExecutor(max_workers=BOT_WORKERS, thread_name_prefix="bot")
 
-@app.route("/new_game")
-def new_game():
+# Most games (or moves) one bulk request may create (or submit)
+MAX_BATCH = 1000
+
+
+@dataclass
+class HostedGame:
+    env: Any
+
+    # JSON-encoded ui_state of each event so far, in event order. Each
+    # one is serialized once, the first time a client asks for it.
+    ui_history: List[JSONString] = field(default_factory=list)
+
+    # Notified whenever env advances (see on_event), so waiting
+    # requests wake up as soon as there is something new.
+    condition: threading.Condition = field(default_factory=threading.Condition)
+
+    # Client actions waiting to be applied, in order. None just runs the
+    # bots (e.g., if a bot moves first). At most one BOT_POOL task
+    # (:run_jobs) drains the queue at a time, so a game's moves are
+    # never applied concurrently.
+    jobs: Deque[Optional[Any]] = field(default_factory=deque)
+    running: bool = False
+    error: Optional[str] = None
+
+    def __post_init__(self):
+        self.env.add_listener(self.on_event)
+
+    def on_event(self, event):
+        with self.condition:
+            self.condition.notify_all()
+
+    def num_events(self) -> int:
+        return len(self.env.event_history)
+
+    def is_over(self) -> bool:
+        return self.env.current_state().is_terminal()
+
+    def is_busy(self) -> bool:
+        '''
+        Jobs queued or running, so GAMES must keep it
+        '''
+        with self.condition:
+            return self.running or bool(self.jobs)
+
+    def can_compact(self) -> bool:
+        '''
+        Finished and no jobs left, so GAMES may compact it to its event
+        log
+        '''
+        with self.condition:
+            return not self.running and not self.jobs and self.is_over()
+
+    def ui_updates(self, since=0) -> Tuple[List[JSONString], int]:
+        '''
+        Encoded ui_states of events[since:], and the cursor (number of
+        events) they run up to
+        '''
+        with self.condition:
+            ui_history = self.ui_history
+            event_history = self.env.event_history
+            for event in event_history[len(ui_history):]:
+                ui_history.append(json.dumps(event.state.ui_state()))
+            since = min(max(since, 0), len(ui_history))
+            return ui_history[since:], len(ui_history)
+
+    def wait_for_updates(
+        self,
+        since,
+        timeout=UPDATE_WAIT_TIMEOUT,
+        or_client_turn=False,
+    ) -> Tuple[List[JSONString], int]:
+        '''
+        Like ui_updates, but if there are no events after :since yet,
+        block until there are (or the game is over, or :timeout). With
+        :or_client_turn, also stop waiting once the game is waiting on a
+        client (e.g., the client moves first).
+        '''
+        with self.condition:
+            self.condition.wait_for(
+                lambda: (
+                    self.num_events() > since
+                    or self.is_over()
+                    or (or_client_turn and self.awaiting_client())
+                ),
+                timeout=timeout,
+            )
+            return self.ui_updates(since)
+
+    def awaiting_client(self) -> bool:
+        '''
+        Is the game waiting on a client's action (no moves pending)?
+        '''
+        with self.condition:
+            if self.running or self.jobs or self.is_over():
+                return False
+            return self.env.acting_agent().is_client()
+
+    def updates_body(self, updates: List[JSONString], cursor: int, error=None) -> JSONString:
+        '''
+        game_updates response. :error (e.g., a rejected move) is
+        reported instead of the last failed job's.
+        '''
+        error = error or self.error
+        return (
+            f'{{"gameHistory":[{",".join(updates)}],"cursor":{cursor}'
+            f',"awaitingClient":{json.dumps(self.awaiting_client())}'
+            f',"gameOver":{json.dumps(self.is_over())}'
+            f',"error":{json.dumps(error)}}}'
+        )
+
+    def submit(self, action=None) -> int:
+        '''
+        Queue a client :action (then bot moves until a client has to
+        act again) and return how many jobs are waiting, without
+        waiting for them.
+
+        A client :action is checked here, so a bad one is rejected
+        (ValueError) instead of failing later in a job: it has to be
+        a client's turn with nothing pending, and the action has to be
+        an eligible int.
+        '''
+        with self.condition:
+            if action is not None:
+                if not self.awaiting_client():
+                    raise ValueError("Not waiting on a client action")
+                # - Actions are ints; == would let true/2.0 through
+                if type(action) is not int:
+                    raise ValueError(f"Action must be an integer: {action!r}")
+                if action not in self.env.current_state().eligible_actions():
+                    raise ValueError(f"Ineligible action: {action!r}")
+            self.jobs.append(action)
+            if not self.running:
+                self.running = True
+                BOT_POOL.submit(self.run_jobs)
+            return len(self.jobs)
+
+    def run_jobs(self):
+        while True:
+            with self.condition:
+                if not self.jobs:
+                    self.running = False
+                    self.condition.notify_all()
+                    return
+                action = self.jobs.popleft()
+
+            # Advance outside the lock so clients can read updates
+            # while bots think
+            env = self.env
+            try:
+                if action is not None:
+                    env.advance(action)
+                env.run_hosted()
+                with self.condition:
+                    self.error = None
+            except Exception as e:
+                app.logger.exception("Game job failed")
+                with self.condition:
+                    self.error = repr(e)
+                    self.condition.notify_all()
+
+
+# guid -> game. Bounded LRU with idle expiry; finished games are kept
+# as event logs and rebuilt on demand (see game_store).
+# - Set GAMESERVER_DB to a SQLite path to share games between worker
+#   processes (e.g., gunicorn -w 4 gameserver:app). Any worker can then
+#   serve any game, rebuilding it from the stored event log.
+GAMESERVER_DB = os.environ.get("GAMESERVER_DB")
+GAMES = GameStore(
+    make_game=HostedGame,
+    backend=SQLiteBackend(GAMESERVER_DB) if GAMESERVER_DB else None,
+)
+
+# With a shared backend another worker may be the one advancing a
+# game, which doesn't wake this worker's waiters, so waits re-check the
+# backend this often.
+BACKEND_POLL_INTERVAL = 0.05
+
+
+class UnknownGame(Exception):
+    pass
+
+
+@app.errorhandler(UnknownGame)
+def unknown_game(e):
+    data = {"gameId": e.args[0], "error": "unknown game"}
+    return jsonify(data), 404
+
+
+def get_game(game_id) -> HostedGame:
+    '''
+    GAMES.get, except unknown games (including evicted and expired
+    ones, which are normal) raise UnknownGame, i.e., answer 404
+    '''
+    try:
+        return GAMES.get(game_id)
+    except KeyError:
+        raise UnknownGame(game_id) from None
+
+
+def wait_for_updates(game_id, since, timeout=UPDATE_WAIT_TIMEOUT, or_client_turn=False):
+    '''
+    (game, updates, cursor) once the game has events after :since, is
+    over, or :timeout passes (see HostedGame.wait_for_updates)
+    '''
+    deadline = time.monotonic() + timeout
+    while True:
+        game = get_game(game_id)
+        remaining = max(deadline - time.monotonic(), 0.0)
+        step = remaining if GAMES.backend is None else min(remaining, BACKEND_POLL_INTERVAL)
+        updates, cursor = game.wait_for_updates(since, step, or_client_turn)
+        done = (
+            updates
+            or game.is_over()
+            or (or_client_turn and game.awaiting_client())
+            or remaining <= step
+        )
+        if done:
+            return game, updates, cursor
+
+# Set GAMESERVER_PROFILE=1 to profile env/agent calls (see /metrics)
+if os.environ.get("GAMESERVER_PROFILE"):
+    profiling.enable()
+
+# Read once at startup; reloaded if a file's mtime changes
+STATIC_ASSETS = StaticAssets()
+STATIC_ASSETS.preload()
 
+
+def start_game() -> str:
     # Start a new game
     # - Advance it until it's a client's turn to act.
     agents = [
@@ -31,33 +280,131 @@ def new_game():
     ]
     env = LuckyGame()
     env.initialize(agents)
-    env.run_hosted()
-
     game_id = str(uuid4())
-    ACTIVE_GAMES[game_id] = env
+    game = HostedGame(env=env)
+    GAMES.add(game_id, game)
+    game.submit()
+    return game_id
+
+
+def batch_items(data, key) -> List:
+    items = data.get(key)
+    if not isinstance(items, list):
+        abort(400, f"{key} must be a list")
+    if len(items) > MAX_BATCH:
+        abort(400, f"At most {MAX_BATCH} {key} per request")
+    return items
+
+
+def check_since(since) -> int:
+    if type(since) is not int or since < 0:
+        abort(400, "since must be a non-negative integer")
+    return since
+
+
+def check_wait(wait) -> float:
+    '''
+    Seconds to wait (capped at UPDATE_WAIT_TIMEOUT); 0 if :wait is unset
+    '''
+    if wait is None:
+        return 0.0
+    if type(wait) not in (int, float) or not wait >= 0:
+        abort(400, "wait must be a non-negative number")
+    return min(float(wait), UPDATE_WAIT_TIMEOUT)
+
 
-    data = {"gameId": game_id}
+@app.route("/new_game")
+def new_game():
+    data = {"gameId": start_game()}
+    return jsonify(data)
+
+
+@app.route("/new_games", methods=["POST"])
+def new_games():
+    '''
+    Start several games in one request.
+
+    Request: {"count": K}
+    Response: {"gameIds": [gameId, ...]}
+    '''
+    data = request.get_json(force=True)
+    count = data.get("count", 1)
+    if not isinstance(count, int) or isinstance(count, bool) or not 0 < count <= MAX_BATCH:
+        abort(400, f"count must be 1..{MAX_BATCH}")
+    data = {"gameIds": [start_game() for _ in range(count)]}
     return jsonify(data)
 
 
 @app.route("/game_updates", methods=["POST"])
 def game_updates():
+    '''
+    ui_states of the events after the client's cursor.
+
+    Request: {"gameId": ..., "since": <number of events the client
+    already has, default 0>, "wait": <optional, long-poll: if there is
+    nothing new, wait up to this many seconds for an event or for it to
+    be a client's turn>}
+    Response: {"gameHistory": [ui_state, ...], "cursor": <since for
+    the next poll>, "awaitingClient": <a client must act next>,
+    "gameOver": <bool>, "error": <why the last job failed, if it did>}
+    '''
     data = request.get_json(force=True)
 
     # Lookup game
     game_id = data["gameId"]
-    env = ACTIVE_GAMES[game_id]
 
     # Get view information
-    gameHistory = []
-    for event in env.event_history:
-        state = event.state
-        gameHistory.append(state.ui_state())
+    # - ui_states are cached already encoded, so just join them
+    since = check_since(data.get("since", 0))
+    timeout = check_wait(data.get("wait"))
+    if timeout:
+        game, updates, cursor = wait_for_updates(game_id, since, timeout, or_client_turn=True)
+    else:
+        game = get_game(game_id)
+        updates, cursor = game.ui_updates(since)
+    body = game.updates_body(updates, cursor)
+    return Response(body, mimetype="application/json")
 
-    data = {
-        "gameHistory": gameHistory,
-    }
-    return jsonify(data)
+
+@app.route("/game_stream")
+def game_stream():
+    '''
+    Server-sent events stream of a game's ui_states.
+
+    GET /game_stream?gameId=...&since=N. Each message's data is a
+    game_updates response and its id is the cursor, so a reconnecting
+    EventSource resumes where it left off (Last-Event-ID). Comments are
+    sent as keep-alives while nothing happens, and a "gameover" event
+    ends the stream (an "unknowngame" event if the game is dropped meanwhile).
+    '''
+    game_id = request.args["gameId"]
+    get_game(game_id) # Fail on unknown games before streaming
+    since = request.headers.get("Last-Event-ID") or request.args.get("since", "0")
+    if not (since.isascii() and since.isdigit()):
+        abort(400, "since must be a non-negative integer")
+    since = int(since)
+
+    def stream(since):
+        while True:
+            try:
+                game, updates, since = wait_for_updates(game_id, since)
+            except UnknownGame:
+                yield 'event: unknowngame\ndata: {"error": "unknown game"}\n\n'
+                return
+            if updates:
+                body = game.updates_body(updates, since)
+                yield f"id: {since}\ndata: {body}\n\n"
+            elif game.is_over():
+                yield "event: gameover\ndata: {}\n\n"
+                return
+            else:
+                yield ": keep-alive\n\n"
+
+    return Response(
+        stream(since),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
 @app.route("/submit_action", methods=["POST"])
@@ -67,32 +414,121 @@ def submit_action():
     game_id = data["gameId"]
     action = data["action"]
 
-    # Advance the game
-    # - First apply the action to do a transition
-    # - Then advance until game needs client action
-    env = ACTIVE_GAMES[game_id]
-    env.advance(action)
-    env.run_hosted()
+    # Queue the action
+    # - A bot worker applies it, then advances until game needs client
+    #   action. Clients see the results through game_updates.
+    # - :success only says whether the action was accepted
+    game = get_game(game_id)
+    try:
+        queued = game.submit(action)
+    except ValueError as e:
+        data = {
+            "success": False,
+            "error": str(e),
+        }
+        return jsonify(data)
 
     data = {
         "success": True,
+        "queued": queued,
     }
     return jsonify(data)
 
 
+@app.route("/submit_actions", methods=["POST"])
+def submit_actions():
+    '''
+    Submit moves for many games in one request and get back each
+    game's updates, e.g., for an external bot playing lots of games at
+    once.
+
+    Request: {"moves": [{"gameId": ..., "action": ..., "since": <the
+    game's cursor>}, ...], "wait": <optional, seconds to wait (in
+    total) for the games to answer>}. :action may be null to just poll.
+    Response: {"results": [...]}, in request order: a game_updates
+    response per move (with the reason in "error" if the move was
+    rejected), or {"gameId": ..., "error": ...} for unknown games.
+
+    All moves are queued before waiting on any game, so the games'
+    bots run concurrently. With :wait, each result is taken once that
+    game has moved past :since (or is waiting on a client again, or is
+    over).
+    '''
+    data = request.get_json(force=True)
+    moves = batch_items(data, "moves")
+    timeout = check_wait(data.get("wait"))
+
+    # Queue everything first
+    # - (game, whether its move was queued, why it was rejected)
+    games = []
+    for move in moves:
+        try:
+            game = GAMES.get(move["gameId"])
+        except KeyError:
+            games.append((None, False, None))
+            continue
+        queued, rejected = False, None
+        if move.get("action") is not None:
+            try:
+                game.submit(move["action"])
+                queued = True
+            except ValueError as e:
+                rejected = str(e)
+        games.append((game, queued, rejected))
+
+    # Collect updates
+    # - One deadline for the whole batch
+    deadline = time.monotonic() + timeout
+    results = []
+    for move, (game, queued, rejected) in zip(moves, games):
+        game_id = move["gameId"]
+        if game is None:
+            results.append(json.dumps({"gameId": game_id, "error": "unknown game"}))
+            continue
+        since = check_since(move.get("since", 0))
+        remaining = max(deadline - time.monotonic(), 0.0)
+        if remaining:
+            # - Wait for a reply to the move, not just the move itself
+            past = since + 1 if queued else since
+            game, _, _ = wait_for_updates(game_id, past, remaining, or_client_turn=True)
+        updates, cursor = game.ui_updates(since)
+        results.append(game.updates_body(updates, cursor, error=rejected))
+    body = f'{{"results":[{",".join(results)}]}}'
+    return Response(body, mimetype="application/json")
+
+
+@app.route("/store_stats")
+def store_stats():
+    return jsonify(GAMES.stats())
+
+
+@app.route("/metrics")
+def metrics():
+    '''
+    Profiling snapshot (see profiling) plus the game store's stats, in
+    Prometheus text format, or as JSON with ?format=json
+    '''
+    stats = GAMES.stats()
+    if request.args.get("format") == "json":
+        return jsonify(dict(profiling.PROFILER.snapshot(), store=stats))
+
+    lines = [profiling.PROFILER.to_prometheus()]
+    for name, value in stats.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f"# TYPE bgbots_store_{name} gauge\nbgbots_store_{name} {value}\n")
+    return Response("".join(lines), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/<filename>.css")
 def static_css(filename):
-    body = open(f"./static/{filename}.css", "r").read()
-    return Response(body, mimetype="text/css")
+    return STATIC_ASSETS.response(f"{filename}.css", "text/css")
 
 
 @app.route("/<filename>.js")
 def static_js(filename):
-    body = open(f"./static/{filename}.js", "r").read()
-    return Response(body, mimetype="text/javascript")
+    return STATIC_ASSETS.response(f"{filename}.js", "text/javascript")
 
 
 @app.route("/")
 def index():
-    response = open("./static/index.html", "r").read()
-    return response
+    return STATIC_ASSETS.response("index.html", "text/html")
@@ -39,7 +39,7 @@ eligible_placements(origin_coords, placed_coords)
 iter_face_up_cards() [DONE]
     same as eligible_cards_flip()
 eligible_pick_ups() [DONE]
-copy()
+copy() [DONE]
 
 effects:
     move_player() [DONE]
@@ -57,13 +57,15 @@ display:
 transitions:
     All of them...
 '''
-from random import choice
+import operator
+import random
+import struct
+import numpy
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import (
-    Any,
-    Callable,
     List,
+    Optional,
     Tuple,
 )
 from base_environment import (
@@ -90,18 +92,6 @@ def parse_coords(coords: str):
     return row, col
 
 
-@dataclass
-class Choice:
-    choice: str
-    on_choice: Tuple[Callable, Any] # fxn, arg1, arg2, ...
-
-    def copy(self):
-        return Choice(
-            self.choice,
-            self.on_choice
-        )
-
-
 STARTING_RES = 5
 MAX_RES = 999
 
@@ -121,17 +111,21 @@ Resource = int # 0:water, 1:food, 2:energy
 Direction = int # up, right, down, left
 
 
-@dataclass
+@dataclass(frozen=True)
 class EffectCard:
-    face_up: bool
+    '''
+    Cards are shared by every board (see EFFECT_CARDS), so they're
+    immutable; boards refer to them by index and track which are face
+    up in a bitmask.
+    '''
     direction: Direction
     row_effect: Tuple[IsSpend, Amount, Resource] # XXX: Change to List[...]
     col_effect: Tuple[IsSpend, Amount, Resource]
 
     @classmethod
-    def build_random(Cls):
+    def build_random(Cls, rng):
+        choice = rng.choice
         c = EffectCard(
-            face_up=False,
             direction=choice(range(4)),
             row_effect=(
                 choice(range(1)),
@@ -146,203 +140,343 @@ class EffectCard:
         )
         return c
 
+    def active_effects(self):
+        # Indexed by effect_num: 0 when adjudicating a row, 1 for a col
+        return (self.row_effect, self.col_effect)
 
-EFFECT_CARDS = [EffectCard.build_random() for _ in range(16)]
 
+# The deck every board draws from. Built from a fixed seed so it's the
+# same in every process: state keys, game logs and self-play shards
+# refer to cards by their index in it.
+DECK_SEED = 16
+_deck_rng = random.Random(DECK_SEED)
+EFFECT_CARDS = [EffectCard.build_random(rng=_deck_rng) for _ in range(16)]
 
-@dataclass
-class Cell(BaseState):
+
+@dataclass(slots=True)
+class Cell:
+    '''
+    Snapshot of one board cell (see State.cell). The board itself is
+    stored as arrays on State.
+    '''
     card: EffectCard
     water: int
     food: int
     energy: int
+    face_up: bool = False
 
     def res_sum(self):
         return self.water + self.food + self.energy
 
 
-class CommonTrans:
+DIRECTION_DELTAS = ((-1, 0), (0, 1), (1, 0), (0, -1)) # up, right, down, left
 
-    @staticmethod
-    def choose_player_location(state, acting_player, after):
-        state.prompt = "Move player {acting_player + 1}"
-        state.choices = []
-        for location in state.eligible_player_movements(acting_player):
-            state.choices.append(Choice(
-                f"Location {location}",
-                after,
-            ))
+
+def valid_placements(placements):
+    '''
+    Snake placement: the next resource goes orthogonally next to the
+    last one placed.
+    '''
+    row, col = placements[-1]
+    coords = []
+    for d_row, d_col in DIRECTION_DELTAS:
+        n_row, n_col = row + d_row, col + d_col
+        if 0 <= n_row < 4 and 0 <= n_col < 4:
+            coords.append((n_row, n_col))
+    return coords
+
+
+Coord = Tuple[int, int] # row, col
+
+
+def cell_bit(row, col):
+    # Bit of a cell in State.face_up
+    return 1 << (row * 4 + col)
+
+
+# (row, col, bit) of the cells on each row/col, indexed [is_row][coord]
+LINE_CELLS = (
+    tuple(tuple((row, col, cell_bit(row, col)) for row in range(4)) for col in range(4)),
+    tuple(tuple((row, col, cell_bit(row, col)) for col in range(4)) for row in range(4)),
+)
+
+# 16-bit cell masks of each row/col, indexed [is_row][coord]
+LINE_MASKS = tuple(
+    tuple(sum(bit for _, _, bit in line) for line in lines)
+    for lines in LINE_CELLS
+)
+
+
+############
+# Actions
+############
+# Every decision in the game is one of a fixed, global set of actions.
+# Action ids are grouped by kind:
+#   0-15:  choose gatherer position (row * 4 + col)
+#   16-23: move player token to location (0-3 rows, 4-7 cols)
+#   24-39: flip card (row * 4 + col)
+#   40-55: place resource (row * 4 + col)
+#   56-58: pick up resource (water, food, energy)
+GATHERER_POSITION_ACTION = 0
+PLAYER_LOCATION_ACTION = 1
+FLIP_ACTION = 2
+PLACE_ACTION = 3
+PICK_UP_ACTION = 4
+
+GATHERER_POSITION_OFFSET = 0
+PLAYER_LOCATION_OFFSET = 16
+FLIP_OFFSET = 24
+PLACE_OFFSET = 40
+PICK_UP_OFFSET = 56
+NUM_ACTIONS = 59
+
+# action id -> (kind, args), label
+ACTIONS: List[Tuple[int, Tuple]] = []
+ACTION_LABELS: List[str] = []
+for row in range(4):
+    for col in range(4):
+        ACTIONS.append((GATHERER_POSITION_ACTION, (row, col)))
+        ACTION_LABELS.append(f"Position: ({row}, {col})")
+for location in range(8):
+    ACTIONS.append((PLAYER_LOCATION_ACTION, (location,)))
+    ACTION_LABELS.append(f"Location {location}")
+for row in range(4):
+    for col in range(4):
+        ACTIONS.append((FLIP_ACTION, (row, col)))
+        ACTION_LABELS.append(f"Coordinate: ({row}, {col})")
+for row in range(4):
+    for col in range(4):
+        ACTIONS.append((PLACE_ACTION, (row, col)))
+        ACTION_LABELS.append(f"Position: ({row}, {col})")
+for res in range(3):
+    ACTIONS.append((PICK_UP_ACTION, (res,)))
+    ACTION_LABELS.append(str(res)) # XXX: Make pretty
+assert len(ACTIONS) == NUM_ACTIONS
+
+ALL_CELLS_MASK = (1 << 16) - 1
+ALL_LOCATIONS_MASK = (1 << 8) - 1
+
+# 16-bit mask of valid snake placements next to each cell
+PLACEMENT_MASKS = tuple(
+    sum(cell_bit(r, c) for r, c in valid_placements([(row, col)]))
+    for row in range(4)
+    for col in range(4)
+)
+
+
+def iter_bits(mask):
+    # Yield the index of each set bit, lowest first
+    while mask:
+        low_bit = mask & -mask
+        yield low_bit.bit_length() - 1
+        mask ^= low_bit
+
+
+############
+# Phases
+############
+# Which decision the state is waiting on
+GATHERER_POSITION_PHASE = 0
+PLAYER_LOCATION_PHASE = 1
+FLIP_PHASE = 2
+PLACE_PHASE = 3
+PICK_UP_PHASE = 4
+GAME_OVER_PHASE = 5
+
+PHASE_PROMPTS = (
+    "Choose gatherer position",
+    "Move player {player}",
+    "Choose card to flip",
+    "Choose placement",
+    "Choose resource to pick up",
+    "Game over",
+)
+
+
+class TurnTrans:
+    '''
+    Game flow between decisions.
+
+    Each on_* handler applies one action to a (copied) state, then the
+    flow runs the automatic steps until the next decision, which it
+    records in state.phase. Turn progress is kept as counters on the
+    state (adj_left, move_left, place_left, ...) so states stay flat.
+    '''
+
+    # Action handlers
 
     @staticmethod
-    def choose_gatherer_position(state, after):
-        state.prompt = "Choose gatherer position"
-        state.choices = []
-        for row in range(4):
-            for col in range(4):
-                state.choices.append(Choice(
-                    f"Position: ({row}, {col})",
-                    after,
-                ))
+    def on_gatherer_position(state, row, col):
+        state.move_gatherer(row, col)
+        TurnTrans.start_turn(state, 0)
 
+    @staticmethod
+    def on_player_location(state, location):
+        state.move_player(state.acting_player_token, location)
+        TurnTrans.choose_card_flip(state)
 
-class SetupTrans:
+    @staticmethod
+    def on_flip(state, row, col):
+        state.flip_card(row, col)
+        TurnTrans.adjudicate_effects(state)
 
     @staticmethod
-    def setup(state):
-        after = (TurnTrans.start_turn, 0)
-        state.call(CommonTrans.choose_gatherer_position, after)
+    def on_place(state, row, col):
+        TurnTrans.place_n_loop(state, row, col)
 
+    @staticmethod
+    def on_pick_up(state, res):
+        state.pick_up_one(state.gatherer_row, state.gatherer_col, res)
+        TurnTrans.gatherer_movement_loop(state)
 
-class TurnTrans:
+    # Flow
 
     @staticmethod
     def start_turn(state, acting_player):
-        after = (TurnTrans.choose_card_flip,)
-        state.call(
-            TurnTrans.choose_player_location,
-            acting_player,
-            after,
-        )
+        state.acting_player_token = acting_player
+        state.phase = PLAYER_LOCATION_PHASE
 
     @staticmethod
     def end_turn(state):
-        next_player = state.next_active_player()
-        state.call(TurnTrans.start_turn, next_player)
+        state.turn_num += 1
+        if state.is_terminal_lazy():
+            state.phase = GAME_OVER_PHASE
+            return
+        TurnTrans.start_turn(state, state.next_active_player())
 
     @staticmethod
     def choose_card_flip(state):
-        state.prompt = "Choose card to flip"
-        state.choices = []
-        for row, col in eli_card_flips():
-            on_choice = (TurnTrans.on_flip_choice, row, col)
-            state.choices.append(Choice(
-                f"Coordinate: ({row}, {col})",
-                on_choice,
-            ))
+        is_row, coord = state.player_line(state.acting_player_token)
 
-    @staticmethod
-    def on_flip_choice(state, row, col):
-        state.flip_card(row, col)
-        state.call(TurnTrans.adjudicate_effects, 0)
+        # Whole row/col is already face up
+        if not LINE_MASKS[is_row][coord] & ~state.face_up:
+            TurnTrans.adjudicate_effects(state)
+            return
+        state.phase = FLIP_PHASE
 
     @staticmethod
     def adjudicate_effects(state):
-        state.adj_effects = fup_effects()[::-1] # reverse ordered?
-        state.call(TurnTrans.adjudicate_effects_loop)
+        is_row, coord = state.player_line(state.acting_player_token)
+        state.adj_left = len(state.face_up_coords(is_row, coord))
+        TurnTrans.adjudicate_effects_loop(state)
 
     @staticmethod
     def adjudicate_effects_loop(state):
         '''
-        Go through state.adj_cells until there are no cells left to
-        adjudicate.
+        Adjudicate the face-up cards in the player's row/col, in order,
+        until there are none left (or a placement needs a decision).
         '''
+        is_row, coord = state.player_line(state.acting_player_token)
+        effect_num = 0 if is_row else 1
+        face_up_coords = state.face_up_coords(is_row, coord)
+        while state.adj_left:
+            row, col = face_up_coords[len(face_up_coords) - state.adj_left]
+            state.adj_left -= 1
+            is_spend, amount, res = state.card(row, col).active_effects()[effect_num]
+            if is_spend == SPEND_EFFECT:
+                state.spend_resources(res, amount)
+            else:
+                # place first resource on card
+                # Then ask where rest of them should go
+                TurnTrans.place_n(state, amount, row, col, res)
+                return
+
         # We're done!
         # - Start moving the gatherer phase
-        if not state.adj_effects:
-            state.call(TurnTrans.start_gatherer_movement,)
-            return
-
-        # Adjudicate next effect
-        row, col, effect_num = state.adj_effects.pop()
-        cell = state.board[row][col]
-        is_spend, amount, res = cell.card.active_effects()[effect_num]
-        if is_spend == SPEND_EFFECT:
-            state.spend_resources(res, amount)
-            state.call(TurnTrans.adjudicate_effects_loop)
-        else:
-            # place first resource on card
-            # Then ask where rest of them should go
-            # Inception callback??
-            after = (TurnTrans.adjudicate_effects_loop,)
-            state.call(TurnTrans.place_n, amount, row, col, res, after)
+        TurnTrans.start_gatherer_movement(state)
 
     @staticmethod
-    def place_n(state, n, row, col, res, after):
+    def place_n(state, n, row, col, res):
         '''
-        Do snake placement of n resources starting at (row, col).
-
-        Then call :after.
+        Do snake placement of n resources starting at (row, col), then
+        go back to adjudicating effects.
         '''
-        state.place_info = dict(left=n, placements=[], after=after)
-        state.call(TurnTrans.place_n_loop, row, col, res)
+        state.place_left = n
+        state.place_res = res
+        TurnTrans.place_n_loop(state, row, col)
 
     @staticmethod
-    def place_n_loop(state, row, col, res):
+    def place_n_loop(state, row, col):
         # Place the resource
-        state.place_resources(row, col, res, 1)
-        state.place_info["left"] -= 1
-        state.placements["placements"].append((row, col))
+        state.place_resources(row, col, state.place_res, 1)
+        state.place_left -= 1
+        state.place_row = row
+        state.place_col = col
 
         # Decide what to do next
-        # - If that was the last resource...
-        #   - Call designated callback
-        # - Else keep placing
-        #   - Call designated callback
-        if state.place_info["left"] <= 0:
-            after = state.place_info["after"]
-            state.call(*after)
+        # - If that was the last resource, keep adjudicating
+        # - Else ask where the next one goes
+        if state.place_left <= 0:
+            state.place_left = 0
+            TurnTrans.adjudicate_effects_loop(state)
             return
-        else:
-            vps = valid_placements(state.place_info["placements"])
-            state.prompt = "Choose placement"
-            state.choices = []
-            for row, col in vps:
-                after = (TurnTrans.place_n_loop, row, col, res)
-                state.choices.append(Choice(
-                    f"Position: ({row}, {col})",
-                    after,
-                ))
+        state.phase = PLACE_PHASE
 
     @staticmethod
     def start_gatherer_movement(state):
-        move_cells = getmovecells()[::-1]
+        is_row, coord = state.player_line(state.acting_player_token)
+        state.move_left = len(state.face_up_coords(is_row, coord))
 
         # No movements to be had
-        if not move_cells:
-            state.call(TurnTrans.end_turn)
+        if not state.move_left:
+            TurnTrans.end_turn(state)
             return
 
-        # Do movements
-        state.move_cells = move_cells
-        state.call(TurnTrans.gatherer_movement_loop)
+        TurnTrans.gatherer_movement_loop(state)
 
     @staticmethod
     def gatherer_movement_loop(state):
-        # Move gatherer
-        cell = state.move_cells.pop()
-        direction = cell.card.direction
-        row, col = state.move_gatherer(direction) # XXX check takes direction
-
-        # If last movement
-        # - Pick up all
-        # - Start next turn
-        if not state.move_cells:
-            state.pick_up_all(row, col)
-            state.call(TurnTrans.end_turn)
-            return
-
-        # No res on cell, keep on moving
-        cell = state.board[row][col]
-        res_choices = cell.res_choices()
-        if not res_choices:
-            state.call(TurnTrans.gatherer_movement_loop)
-            return
-
-        # Res on cell, choose what to pick up
-        state.prompt = "Choose resource to pick up"
-        state.choices = []
-        after = (TurnTrans.gatherer_movement_loop,)
-        for res in res_choices:
-            state.choices.append(Choice(
-                str(res), # XXX: Make pretty
-                after,
-            ))
-
-
-Coord = Tuple[int, int] # row, col
-
+        '''
+        Move the gatherer once per face-up card in the player's row/col.
+        '''
+        is_row, coord = state.player_line(state.acting_player_token)
+        face_up_coords = state.face_up_coords(is_row, coord)
+        while True:
+            # Move gatherer
+            card_row, card_col = face_up_coords[len(face_up_coords) - state.move_left]
+            state.move_left -= 1
+            row, col = state.step_gatherer(state.card(card_row, card_col).direction)
+
+            # If last movement
+            # - Pick up all
+            # - Start next turn
+            if not state.move_left:
+                state.pick_up_all(row, col)
+                TurnTrans.end_turn(state)
+                return
+
+            # Res on cell, choose what to pick up
+            # - Else keep on moving
+            if state.resources[row, col].any():
+                state.phase = PICK_UP_PHASE
+                return
+
+
+# Action kind -> handler(state, *args)
+ACTION_HANDLERS = (
+    TurnTrans.on_gatherer_position,
+    TurnTrans.on_player_location,
+    TurnTrans.on_flip,
+    TurnTrans.on_place,
+    TurnTrans.on_pick_up,
+)
 
-@dataclass
+# State key layout (little-endian, fixed width)
+# - Header: acting_agent, turn_num, acting_player_token, p1_location,
+#   p2_location, gatherer_row, gatherer_col, phase, adj_left,
+#   move_left, place_left, place_res, place_row, place_col (1 byte
+#   each), the water, food, energy supply (2 bytes each) and the
+#   face_up bitmask (2 bytes)
+# - 16 EFFECT_CARDS indices, row-major (1 byte each). Only portable
+#   between processes because the deck is built from DECK_SEED.
+# - The (4, 4, 3) resources array, row-major (2 bytes each)
+KEY_HEADER = struct.Struct("<14B4H")
+KEY_CARDS_SIZE = 16
+KEY_RESOURCES_SIZE = 4 * 4 * 3 * 2
+KEY_SIZE = KEY_HEADER.size + KEY_CARDS_SIZE + KEY_RESOURCES_SIZE
+
+
+@dataclass(slots=True)
 class State(BaseState):
     turn_num: int
     acting_player_token: int
@@ -350,39 +484,218 @@ class State(BaseState):
     p2_location: int
     gatherer_row: int
     gatherer_col: int
-    board: List[List[Cell]]
+
+    # Board
+    # - card_idx: (16,) int8 indices into EFFECT_CARDS, row-major.
+    #   Never written after setup, so copies share it.
+    # - face_up: bit (row * 4 + col) set if that card is face up
+    # - resources: (4, 4, 3) int16 water/food/energy on each cell
+    card_idx: numpy.ndarray
+    face_up: int
+    resources: numpy.ndarray
+
     water: int # XXX: Starting? Discard has finite size?
     food: int
     energy: int
 
-    # Choice info for UI
-    prompt: str
-    choices: List[Choice]
+    # Decision the state is waiting on (see *_PHASE)
+    phase: int
+
+    # In-progress turn bookkeeping
+    # - adj_left/move_left: face-up cards in the player's row/col still
+    #   to adjudicate/move the gatherer for (taken in line order)
+    # - place_*: resources left to place, their type and the last cell
+    #   one was placed on
+    adj_left: int = 0
+    move_left: int = 0
+    place_left: int = 0
+    place_res: int = 0
+    place_row: int = 0
+    place_col: int = 0
+
+    # While Environment.apply runs: (row, col, old [water, food,
+    # energy]) of each cell the action changes, for undo
+    _resource_log: Optional[List] = field(init=False, default=None)
 
-    def call(self, *args):
+    @classmethod
+    def from_state_key(cls, state_key):
         '''
-        Call a state modifying function
+        Rebuild a state exactly from its state key
+        '''
+        (
+            acting_agent,
+            turn_num,
+            acting_player_token,
+            p1_location,
+            p2_location,
+            gatherer_row,
+            gatherer_col,
+            phase,
+            adj_left,
+            move_left,
+            place_left,
+            place_res,
+            place_row,
+            place_col,
+            water,
+            food,
+            energy,
+            face_up,
+        ) = KEY_HEADER.unpack_from(state_key, 0)
+
+        offset = KEY_HEADER.size
+        card_idx = numpy.frombuffer(
+            state_key,
+            dtype=numpy.int8,
+            count=KEY_CARDS_SIZE,
+            offset=offset,
+        ).copy()
+        offset += KEY_CARDS_SIZE
+        resources = numpy.frombuffer(
+            state_key,
+            dtype="<i2",
+            count=4 * 4 * 3,
+            offset=offset,
+        ).astype(numpy.int16).reshape(4, 4, 3)
+
+        return cls(
+            acting_agent=acting_agent,
+            turn_num=turn_num,
+            acting_player_token=acting_player_token,
+            p1_location=p1_location,
+            p2_location=p2_location,
+            gatherer_row=gatherer_row,
+            gatherer_col=gatherer_col,
+            card_idx=card_idx,
+            face_up=face_up,
+            resources=resources,
+            water=water,
+            food=food,
+            energy=energy,
+            phase=phase,
+            adj_left=adj_left,
+            move_left=move_left,
+            place_left=place_left,
+            place_res=place_res,
+            place_row=place_row,
+            place_col=place_col,
+        )
 
-        This state (self) is injected as first argument in call. State
-        objects should never be passed in with :args.
+    def to_state_key(self):
+        '''
+        Fixed-layout byte string of KEY_SIZE bytes (see KEY_* above)
+        '''
+        header = KEY_HEADER.pack(
+            self.acting_agent,
+            self.turn_num,
+            self.acting_player_token,
+            self.p1_location,
+            self.p2_location,
+            self.gatherer_row,
+            self.gatherer_col,
+            self.phase,
+            self.adj_left,
+            self.move_left,
+            self.place_left,
+            self.place_res,
+            self.place_row,
+            self.place_col,
+            self.water,
+            self.food,
+            self.energy,
+            self.face_up,
+        )
+        return (
+            header
+            + self.card_idx.tobytes()
+            + self.resources.astype("<i2", copy=False).tobytes()
+        )
 
-        args:
-          - 0: fxn
-          - (1, ...): fxn args
+    def legal_actions_mask(self) -> int:
+        '''
+        Bitmask over the global action ids (bit i set if action i is
+        legal here)
         '''
-        return args[0](self, *args[1:])
+        phase = self.phase
+        if phase == PLAYER_LOCATION_PHASE:
+            other = self.p2_location if self.acting_player_token == 0 else self.p1_location
+            return (ALL_LOCATIONS_MASK & ~(1 << other)) << PLAYER_LOCATION_OFFSET
+        if phase == FLIP_PHASE:
+            is_row, coord = self.player_line(self.acting_player_token)
+            return (LINE_MASKS[is_row][coord] & ~self.face_up) << FLIP_OFFSET
+        if phase == PICK_UP_PHASE:
+            mask = 0
+            for res, n in enu(self.resources[self.gatherer_row, self.gatherer_col].tolist()):
+                if n > 0:
+                    mask |= 1 << res
+            return mask << PICK_UP_OFFSET
+        if phase == PLACE_PHASE:
+            return PLACEMENT_MASKS[self.place_row * 4 + self.place_col] << PLACE_OFFSET
+        if phase == GATHERER_POSITION_PHASE:
+            return ALL_CELLS_MASK << GATHERER_POSITION_OFFSET
+        return 0
 
-    def from_state_key(cls, state_key):
-        raise NotImplementedError()
+    def eligible_actions_lazy(self):
+        return list(iter_bits(self.legal_actions_mask()))
 
-    def to_state_key(self):
-        raise NotImplementedError()
+    def prompt(self) -> str:
+        return PHASE_PROMPTS[self.phase].format(player=self.acting_player_token + 1)
 
-    def eligible_actions_lazy(self):
-        raise NotImplementedError()
+    def choice_labels(self) -> List[str]:
+        return [ACTION_LABELS[action] for action in self.eligible_actions()]
 
     def copy(self):
-        pass
+        '''
+        The board is arrays plus a bitmask, so copying it is a single
+        buffer copy of resources; card_idx is never written and is
+        shared. Everything else is an int.
+        '''
+        return State(
+            acting_agent=self.acting_agent,
+            turn_num=self.turn_num,
+            acting_player_token=self.acting_player_token,
+            p1_location=self.p1_location,
+            p2_location=self.p2_location,
+            gatherer_row=self.gatherer_row,
+            gatherer_col=self.gatherer_col,
+            card_idx=self.card_idx,
+            face_up=self.face_up,
+            resources=self.resources.copy(),
+            water=self.water,
+            food=self.food,
+            energy=self.energy,
+            phase=self.phase,
+            adj_left=self.adj_left,
+            move_left=self.move_left,
+            place_left=self.place_left,
+            place_res=self.place_res,
+            place_row=self.place_row,
+            place_col=self.place_col,
+        )
+
+    def card(self, row, col) -> EffectCard:
+        return EFFECT_CARDS[self.card_idx[row * 4 + col]]
+
+    def cell(self, row, col) -> Cell:
+        water, food, energy = self.resources[row, col].tolist()
+        return Cell(
+            card=self.card(row, col),
+            water=water,
+            food=food,
+            energy=energy,
+            face_up=bool(self.face_up & cell_bit(row, col)),
+        )
+
+    def player_line(self, player) -> Tuple[bool, int]:
+        '''
+        (is_row, coord) of the row/col a player's token is on.
+        Locations 0-3 are rows 0-3 and 4-7 are cols 0-3.
+        '''
+        location = self.p1_location if player == 0 else self.p2_location
+        return location < 4, location % 4
+
+    def next_active_player(self):
+        return 1 if self.acting_player_token == 0 else 0
 
     def eligible_player_movements(self, player):
         locations = list(range(8))
@@ -391,20 +704,32 @@ class State(BaseState):
         return locations
 
     def iter_cells(self, is_row, coord) -> Tuple[Coord, Cell]:
-        if is_row:
-            for col, cell in enu(self.board[coord]):
-                yield (coord, col), cell
-        else:
-            for row in range(4):
-                yield (row, coord), self.board[row][coord]
+        for row, col, _ in LINE_CELLS[is_row][coord]:
+            yield (row, col), self.cell(row, col)
 
     def flippable_coords(self, is_row, coord):
-        cards = []
-        for coord, cell in self.iter_cells(is_row, coord):
-            if cell.card.face_up:
-                continue
-            cards.append(coord)
-        return cards
+        face_up = self.face_up
+        return [
+            (row, col)
+            for row, col, bit in LINE_CELLS[is_row][coord]
+            if not face_up & bit
+        ]
+
+    def face_up_coords(self, is_row, coord):
+        face_up = self.face_up
+        return [
+            (row, col)
+            for row, col, bit in LINE_CELLS[is_row][coord]
+            if face_up & bit
+        ]
+
+    def line_resources(self, is_row, coord) -> numpy.ndarray:
+        '''
+        Total (water, food, energy) on a row/col
+        '''
+        if is_row:
+            return self.resources[coord].sum(axis=0)
+        return self.resources[:, coord].sum(axis=0)
 
     def move_player(self, player, location):
         if player == 0:
@@ -415,7 +740,7 @@ class State(BaseState):
             raise KeyError()
 
     def flip_card(self, row, col):
-        self.board[row][col].card.face_up = True
+        self.face_up |= cell_bit(row, col)
 
     def spend_resources(self, resource: int, amount):
         if resource == 0:
@@ -428,23 +753,24 @@ class State(BaseState):
             raise KeyError()
 
     def place_resources(self, row: int, col: int, resource: int, amount: int):
-        cell = self.board[row][col]
-        if resource == 0:
-            cell.water = clamp(0, self.water - amount, MAX_RES)
-        elif resource == 1:
-            cell.food = clamp(0, self.food - amount, MAX_RES)
-        elif resource == 2:
-            cell.energy = clamp(0, self.energy - amount, MAX_RES)
-        else:
+        '''
+        Move :amount of :resource from the supply onto a cell
+        '''
+        if resource not in (0, 1, 2):
             raise KeyError()
+        cell_resources = self.resources[row, col]
+        if self._resource_log is not None:
+            self._resource_log.append((row, col, cell_resources.tolist()))
+        cell_resources[resource] = clamp(0, int(cell_resources[resource]) + amount, MAX_RES)
+        self.spend_resources(resource, amount)
 
     def gain_resources(self, resource: int, amount: int):
         if resource == 0:
-            self.water = clamp(0, self.water - amount, MAX_RES)
+            self.water = clamp(0, self.water + amount, MAX_RES)
         elif resource == 1:
-            self.food = clamp(0, self.food - amount, MAX_RES)
+            self.food = clamp(0, self.food + amount, MAX_RES)
         elif resource == 2:
-            self.energy = clamp(0, self.energy - amount, MAX_RES)
+            self.energy = clamp(0, self.energy + amount, MAX_RES)
         else:
             raise KeyError()
 
@@ -452,53 +778,45 @@ class State(BaseState):
         self.gatherer_row = row
         self.gatherer_col = col
 
+    def step_gatherer(self, direction):
+        '''
+        Move the gatherer one cell in :direction, stopping at the edge
+        of the board.
+        '''
+        d_row, d_col = DIRECTION_DELTAS[direction]
+        row = clamp(0, self.gatherer_row + d_row, 3)
+        col = clamp(0, self.gatherer_col + d_col, 3)
+        self.move_gatherer(row, col)
+        return row, col
+
     def eligible_pick_ups(self, row, col):
         '''
         Which resources can be picked up here?
         '''
-        cell = self.board[row][col]
-        res = []
-        if cell.water > 0:
-            res.append(0)
-        if cell.food > 0:
-            res.append(1)
-        if cell.energy > 0:
-            res.append(2)
-        return res
+        return [res for res, n in enu(self.resources[row, col].tolist()) if n > 0]
 
     def pick_up_one(self, row, col, resource):
-        cell = self.board[row][col]
-        if resource == 0:
-            if cell.water <= 0:
-                raise RuntimeError("How?")
-            cell.water = self.water - 1
-            self.gain_resources(resource, 1)
-        elif resource == 1:
-            if cell.food <= 0:
-                raise RuntimeError("How?")
-            cell.food = self.food - 1
-            self.gain_resources(resource, 1)
-        elif resource == 2:
-            if cell.energy <= 0:
-                raise RuntimeError("How?")
-            cell.energy = self.energy - 1
-            self.gain_resources(resource, 1)
-        else:
+        if resource not in (0, 1, 2):
             raise KeyError()
+        cell_resources = self.resources[row, col]
+        if cell_resources[resource] <= 0:
+            raise RuntimeError("How?")
+        if self._resource_log is not None:
+            self._resource_log.append((row, col, cell_resources.tolist()))
+        cell_resources[resource] -= 1
+        self.gain_resources(resource, 1)
 
     def pick_up_all(self, row, col):
-        cell = self.board[row][col]
-        if cell.water >= 0:
-            self.gain_resources(0, cell.water)
-            cell.water = 0
-
-        if cell.food >= 0:
-            self.gain_resources(1, cell.food)
-            cell.food = 0
-
-        if cell.energy >= 0:
-            self.gain_resources(2, cell.energy)
-            cell.energy = 0
+        cell_resources = self.resources[row, col]
+        water, food, energy = cell_resources.tolist()
+        if not (water or food or energy):
+            return
+        if self._resource_log is not None:
+            self._resource_log.append((row, col, [water, food, energy]))
+        cell_resources[:] = 0
+        self.gain_resources(0, water)
+        self.gain_resources(1, food)
+        self.gain_resources(2, energy)
 
     def is_resource_exhausted(self):
         return (self.water <= 0) or (self.food <= 0) or (self.energy <= 0)
@@ -508,25 +826,60 @@ class State(BaseState):
             return True
         if self.turn_num == 12: # Reads: "On the start of 13th turn"
             return True
+        return False
 
     def to_display_string(self, rich=True) -> str:
         pass
 
     def choice_display_str(self, action):
-        return f"  Player chose: {action}"
+        return f"  Player chose: {ACTION_LABELS[action]}"
 
     def ui_state(self):
         pass
 
-    def rewards(self):
+    def rewards_lazy(self):
         if not self.is_terminal():
             return [0.0]
-        if sum(self.water, self.food, self.energy) > 10:
+        if self.water + self.food + self.energy > 10:
             return [1.0]
         else:
             return [-1.0]
 
 
+# Fields Environment.apply saves for undo: the ints. card_idx is never
+# written, and resources changes are logged per cell instead.
+# - Same order as the assignment in Environment.undo
+UNDO_FIELDS = (
+    "acting_agent",
+    "_cached_is_terminal",
+    "_cached_eligible_actions",
+    "_cached_rewards",
+    "turn_num",
+    "acting_player_token",
+    "p1_location",
+    "p2_location",
+    "gatherer_row",
+    "gatherer_col",
+    "face_up",
+    "water",
+    "food",
+    "energy",
+    "phase",
+    "adj_left",
+    "move_left",
+    "place_left",
+    "place_res",
+    "place_row",
+    "place_col",
+)
+assert set(UNDO_FIELDS) == {
+    name
+    for cls in (BaseState, State)
+    for name in cls.__slots__
+} - {"card_idx", "resources", "_resource_log"}
+get_undo_fields = operator.attrgetter(*UNDO_FIELDS)
+
+
 @dataclass
 class Environment(BaseEnvironment):
     NAME = "Gatherer"
@@ -538,14 +891,11 @@ class Environment(BaseEnvironment):
         p2_location = 4
         gatherer_row = 0
         gatherer_col = 0
-        board = []
-        for _ in range(4):
-            row = []
-            for _ in range(4):
-                card = choice(EFFECT_CARDS)
-                cell = Cell(card=card, water=0, food=0, energy=0)
-                row.append(cell)
-            board.append(row)
+        num_cards = len(EFFECT_CARDS)
+        card_idx = numpy.array(
+            [self.rng.randrange(num_cards) for _ in range(16)],
+            dtype=numpy.int8,
+        )
 
         state = State(
             acting_agent=acting_agent,
@@ -555,35 +905,85 @@ class Environment(BaseEnvironment):
             p2_location=p2_location,
             gatherer_row=gatherer_row,
             gatherer_col=gatherer_col,
-            board=board,
+            card_idx=card_idx,
+            face_up=0,
+            resources=numpy.zeros((4, 4, 3), dtype=numpy.int16),
             water=STARTING_RES,
             food=STARTING_RES,
             energy=STARTING_RES,
-            prompt=prompt,
-            choices=choices,
-            phase=phase,
-            subphase=subphase,
+            phase=GATHERER_POSITION_PHASE,
         )
-
-        # Do initial transitions
-        state.call(SetupTrans.setup)
+        return state
 
     def transition(self, state, action) -> State:
+        '''
+        :action is a global action id (see ACTIONS) and must be legal
+        in :state (see State.legal_actions_mask).
+        '''
         rstate = state.copy()
 
-        # Call the corresponding handler for the choice
-        choice = rstate.choices[action]
-        rstate.call(*choice.on_choice)
+        # Dispatch to the handler for the action's kind
+        kind, args = ACTIONS[action]
+        ACTION_HANDLERS[kind](rstate, *args)
         return rstate
 
+    def apply(self, state, action):
+        '''
+        In-place transition.
+
+        The token is the int fields' values plus the old contents of
+        just the cells the action changes (logged by the State's
+        resource methods); the board arrays aren't copied.
+        '''
+        resource_log = []
+        token = (get_undo_fields(state), resource_log)
+        state._resource_log = resource_log
+        state._cached_is_terminal = None
+        state._cached_eligible_actions = None
+        state._cached_rewards = None
+        kind, args = ACTIONS[action]
+        ACTION_HANDLERS[kind](state, *args)
+        state._resource_log = None
+        return token
+
+    def undo(self, state, token):
+        values, resource_log = token
+        # One unpacking assignment: much cheaper than a setattr loop
+        (
+            state.acting_agent,
+            state._cached_is_terminal,
+            state._cached_eligible_actions,
+            state._cached_rewards,
+            state.turn_num,
+            state.acting_player_token,
+            state.p1_location,
+            state.p2_location,
+            state.gatherer_row,
+            state.gatherer_col,
+            state.face_up,
+            state.water,
+            state.food,
+            state.energy,
+            state.phase,
+            state.adj_left,
+            state.move_left,
+            state.place_left,
+            state.place_res,
+            state.place_row,
+            state.place_col,
+        ) = values
+        resources = state.resources
+        for row, col, old in reversed(resource_log):
+            resources[row, col] = old
+
     def parse_action_input(self, input_string):
         '''Used for converting human input to action'''
         raise NotImplementedError()
 
     def possible_actions(self):
         '''Used for bots that need it'''
-        raise NotImplementedError()
+        return list(range(NUM_ACTIONS))
 
     def reward_range(self):
         '''Used for bots that need it'''
-        raise NotImplementedError()
+        return (-1.0, 1.0)
@@ -1,5 +1,3 @@
-from random import choice
-
 from dataclasses import dataclass
 from typing import (
     # Any,
@@ -12,8 +10,25 @@ from base_environment import (
 
 enu = enumerate
 
+# State key bit layout (LSB first)
+# - 1 bit: acting_agent
+# - 3 bits: prize
+# - 2 bits per box: box state (0, 1, 2)
+KEY_PRIZE_SHIFT = 1
+KEY_BOXES_SHIFT = 4
+KEY_BOX_BITS = 2
 
-@dataclass
+
+def build_choices(boxes):
+    # Build the UI choices
+    choices = []
+    for i, bstate in enu(boxes):
+        if bstate == 0:
+            choices.append(str(i))
+    return choices
+
+
+@dataclass(slots=True)
 class State(BaseState):
     boxes: List[int]
     prize: int
@@ -22,11 +37,43 @@ class State(BaseState):
     prompt: str
     choices: List[str]
 
+    @classmethod
     def from_state_key(cls, state_key):
-        raise NotImplementedError()
+        acting_agent = state_key & 1
+        prize = (state_key >> KEY_PRIZE_SHIFT) & 0b111
+        boxes = []
+        box_bits = state_key >> KEY_BOXES_SHIFT
+        for _ in range(5):
+            boxes.append(box_bits & 0b11)
+            box_bits >>= KEY_BOX_BITS
+        return cls(
+            acting_agent=acting_agent,
+            boxes=boxes,
+            prize=prize,
+            prompt="Choose box",
+            choices=build_choices(boxes),
+        )
 
     def to_state_key(self):
-        raise NotImplementedError()
+        '''
+        Pack the state into a 14-bit int (see KEY_* layout above).
+        prompt/choices are derived from the boxes so aren't stored.
+        '''
+        key = self.acting_agent | (self.prize << KEY_PRIZE_SHIFT)
+        shift = KEY_BOXES_SHIFT
+        for bstate in self.boxes:
+            key |= bstate << shift
+            shift += KEY_BOX_BITS
+        return key
+
+    def copy(self):
+        return State(
+            acting_agent=self.acting_agent,
+            boxes=self.boxes[:],
+            prize=self.prize,
+            prompt=self.prompt,
+            choices=self.choices[:],
+        )
 
     def eligible_actions_lazy(self):
         # choices are ~ ["0", "2", ...]
@@ -66,12 +113,13 @@ class State(BaseState):
             winner=winner,
         )
 
-    def rewards(self):
-        if self.winner() is None:
+    def rewards_lazy(self):
+        winner = self.winner()
+        if winner is None:
             return [0.0, 0.0]
 
         r = [-1.0, -1.0]
-        r[self.winner() - 1] = 1.0
+        r[winner - 1] = 1.0
         return r
 
 
@@ -81,16 +129,16 @@ class Environment(BaseEnvironment):
     STATE = State
 
     def initial_state(self):
-        acting_agent = choice(range(2))
+        rng = self.rng
+        acting_agent = rng.choice(range(2))
         boxes = [0] * 5
-        prize = choice(range(5))
-        choices = [str(i) for i in range(5)]
+        prize = rng.choice(range(5))
         return State(
             acting_agent=acting_agent,
             boxes=boxes,
             prize=prize,
             prompt="Choose box",
-            choices=choices,
+            choices=build_choices(boxes),
         )
 
     def transition(self, state, action) -> State:
@@ -104,28 +152,58 @@ class Environment(BaseEnvironment):
         # [0, 1, 0]
         boxes[action] = state.acting_agent + 1
 
-        # Build the UI choices
-        choices = []
-        for i, bstate in enumerate(boxes):
-            if bstate == 0:
-                choices.append(str(i))
-
         return State(
             acting_agent=acting_agent,
             boxes=boxes,
             prize=state.prize,
             prompt=state.prompt,
-            choices=choices,
+            choices=build_choices(boxes),
         )
 
+    def apply(self, state, action):
+        '''
+        In-place transition. The box is picked and its choice removed,
+        nothing else is allocated but the token.
+        '''
+        choice_idx = state.choices.index(str(action))
+        token = (
+            action,
+            choice_idx,
+            state._cached_is_terminal,
+            state._cached_eligible_actions,
+            state._cached_rewards,
+        )
+        state.boxes[action] = state.acting_agent + 1
+        state.acting_agent = 1 if state.acting_agent == 0 else 0
+        del state.choices[choice_idx]
+        state._cached_is_terminal = None
+        state._cached_eligible_actions = None
+        state._cached_rewards = None
+        return token
+
+    def undo(self, state, token):
+        (
+            action,
+            choice_idx,
+            cached_is_terminal,
+            cached_eligible_actions,
+            cached_rewards,
+        ) = token
+        state.boxes[action] = 0
+        state.acting_agent = 1 if state.acting_agent == 0 else 0
+        state.choices.insert(choice_idx, str(action))
+        state._cached_is_terminal = cached_is_terminal
+        state._cached_eligible_actions = cached_eligible_actions
+        state._cached_rewards = cached_rewards
+
     def parse_action_input(self, input_string):
         '''Used for converting human input to action'''
         raise NotImplementedError()
 
     def possible_actions(self):
         '''Used for bots that need it'''
-        raise NotImplementedError()
+        return list(range(5))
 
     def reward_range(self):
         '''Used for bots that need it'''
-        raise NotImplementedError()
+        return (-1.0, 1.0)
@@ -0,0 +1,569 @@
+'''
+Monte Carlo tree search agent with a PUCT selection rule.
+
+The tree is stored in flat NumPy arrays instead of per-node objects:
+nodes and edges are integer indices, and a node's edges are a contiguous
+slice [first_edge, first_edge + num_edges). Leaves are evaluated with a
+uniformly random playout, and priors are uniform until there is a model
+to provide them.
+
+Edge statistics are from the point of view of the agent acting at the
+edge's parent node, so selection at any node is just argmax(Q + U).
+
+Parallel modes:
+    - leaf_batch_size > 1: select that many leaves per iteration (with
+      virtual loss) and evaluate them in one evaluate_batch call.
+    - num_search_workers > 1: root parallelism over a shared process pool;
+      each worker searches its own tree and root visit counts are
+      summed.
+'''
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, fields
+import math
+import random
+import threading
+import time
+from typing import (
+    ClassVar,
+    Dict,
+    List,
+    Optional,
+)
+import numpy
+from rich import print as rprint
+
+from base_agent import Agent as BaseAgent
+from custom_types import (
+    Action,
+    EnvironmentType,
+    Policy,
+    Temperature,
+    Values,
+)
+from run_contexts import RunContexts
+from settings import SETTINGS
+from transposition import TranspositionTable
+from batched_luckygame import BatchedLuckyGame
+
+UNEXPANDED = -1
+NO_CHILD = -1
+VIRTUAL_LOSS = 1.0
+
+
+def luckygame_batch_values(states, seed) -> List[Values]:
+    return BatchedLuckyGame.from_states(states, seed=seed).run_random().tolist()
+
+
+# Environment NAME -> fxn(states, seed) returning values for each state
+BATCH_EVALUATORS = {
+    "Lucky": luckygame_batch_values,
+}
+
+# Worker count -> process pool for root-parallel search, shared by every
+# agent so agents built per game/run don't each start (and leak) their
+# own worker processes. Shut down at exit.
+SEARCH_POOLS: Dict[int, ProcessPoolExecutor] = {}
+SEARCH_POOLS_LOCK = threading.Lock()
+
+
+def search_pool(num_workers) -> ProcessPoolExecutor:
+    with SEARCH_POOLS_LOCK:
+        pool = SEARCH_POOLS.get(num_workers)
+        if pool is None:
+            pool = SEARCH_POOLS[num_workers] = ProcessPoolExecutor(max_workers=num_workers)
+        return pool
+
+
+@atexit.register
+def shutdown_search_pools():
+    with SEARCH_POOLS_LOCK:
+        for pool in SEARCH_POOLS.values():
+            pool.shutdown()
+        SEARCH_POOLS.clear()
+
+
+@dataclass
+class SearchTree:
+    '''
+    Array-backed search tree. Arrays grow by doubling.
+    '''
+    initial_capacity: int = 1024
+
+    num_nodes: int = field(init=False, default=0)
+    num_edges: int = field(init=False, default=0)
+
+    # Per node
+    node_states: List = field(init=False, default_factory=list)
+    node_visits: numpy.ndarray = field(init=False)
+    node_first_edge: numpy.ndarray = field(init=False)
+    node_num_edges: numpy.ndarray = field(init=False)
+
+    # Per edge
+    edge_action: numpy.ndarray = field(init=False)
+    edge_child: numpy.ndarray = field(init=False)
+    edge_visits: numpy.ndarray = field(init=False)
+    edge_value_sum: numpy.ndarray = field(init=False)
+    edge_prior: numpy.ndarray = field(init=False)
+
+    def __post_init__(self):
+        n = self.initial_capacity
+        self.node_visits = numpy.zeros(n, dtype=numpy.int64)
+        self.node_first_edge = numpy.zeros(n, dtype=numpy.int64)
+        self.node_num_edges = numpy.full(n, UNEXPANDED, dtype=numpy.int32)
+        self.edge_action = numpy.zeros(n, dtype=numpy.int64)
+        self.edge_child = numpy.full(n, NO_CHILD, dtype=numpy.int64)
+        self.edge_visits = numpy.zeros(n, dtype=numpy.int64)
+        self.edge_value_sum = numpy.zeros(n, dtype=numpy.float64)
+        self.edge_prior = numpy.zeros(n, dtype=numpy.float64)
+
+    @staticmethod
+    def _grown(array, size, fill):
+        new_array = numpy.full(max(size, 2 * len(array)), fill, dtype=array.dtype)
+        new_array[:len(array)] = array
+        return new_array
+
+    def add_node(self, state) -> int:
+        node = self.num_nodes
+        if node >= len(self.node_visits):
+            size = node + 1
+            self.node_visits = self._grown(self.node_visits, size, 0)
+            self.node_first_edge = self._grown(self.node_first_edge, size, 0)
+            self.node_num_edges = self._grown(self.node_num_edges, size, UNEXPANDED)
+        self.node_states.append(state)
+        self.num_nodes += 1
+        return node
+
+    def expand(self, node, actions, priors):
+        '''
+        Add an edge per action for :node
+        '''
+        first = self.num_edges
+        end = first + len(actions)
+        if end > len(self.edge_action):
+            self.edge_action = self._grown(self.edge_action, end, 0)
+            self.edge_child = self._grown(self.edge_child, end, NO_CHILD)
+            self.edge_visits = self._grown(self.edge_visits, end, 0)
+            self.edge_value_sum = self._grown(self.edge_value_sum, end, 0.0)
+            self.edge_prior = self._grown(self.edge_prior, end, 0.0)
+        self.edge_action[first:end] = actions
+        self.edge_prior[first:end] = priors
+        self.node_first_edge[node] = first
+        self.node_num_edges[node] = len(actions)
+        self.num_edges = end
+
+    def is_expanded(self, node) -> bool:
+        return self.node_num_edges[node] != UNEXPANDED
+
+    def edge_slice(self, node) -> slice:
+        first = self.node_first_edge[node]
+        return slice(first, first + self.node_num_edges[node])
+
+    def select_edge(self, node, c_puct) -> int:
+        '''
+        PUCT: argmax Q(s, a) + c * P(s, a) * sqrt(N(s)) / (1 + N(s, a))
+
+        Unvisited edges have Q = 0.
+        '''
+        edges = self.edge_slice(node)
+        visits = self.edge_visits[edges]
+        q = self.edge_value_sum[edges] / numpy.maximum(visits, 1)
+        sqrt_n = math.sqrt(max(self.node_visits[node], 1))
+        u = c_puct * self.edge_prior[edges] * sqrt_n / (1 + visits)
+        return edges.start + int(numpy.argmax(q + u))
+
+    def child_for_action(self, node, action) -> int:
+        if not self.is_expanded(node):
+            return NO_CHILD
+        edges = self.edge_slice(node)
+        matches = numpy.flatnonzero(self.edge_action[edges] == action)
+        if not len(matches):
+            return NO_CHILD
+        return int(self.edge_child[edges.start + matches[0]])
+
+
+@dataclass
+class Agent(BaseAgent):
+    NAME: ClassVar[str] = "mcts"
+
+    num_simulations: int = 200
+    time_budget: Optional[float] = None # seconds per move
+    c_puct: float = 1.5
+    temperature: Temperature = 0.0
+    max_nodes: int = 1_000_000
+    use_transposition_table: bool = False
+    transposition_table_size: int = 100_000
+    leaf_batch_size: int = 1 # leaves evaluated together per iteration
+    num_search_workers: int = 1 # >1 for root-parallel search
+
+    tree: SearchTree = field(init=False, default=None)
+    root: int = field(init=False, default=0)
+    rng: random.Random = field(init=False, default=None)
+    table: Optional[TranspositionTable] = field(init=False, default=None)
+    last_search: Dict = field(init=False, default_factory=dict)
+    last_policy: Dict[Action, float] = field(init=False, default_factory=dict)
+
+    def __post_init__(self):
+        if self.num_simulations < 1:
+            raise ValueError(f"num_simulations must be >= 1, got {self.num_simulations}")
+
+    @classmethod
+    def build_settings(
+        cls,
+        env_type: EnvironmentType,
+        run_context: RunContexts,
+        version: int = None,
+    ):
+        if run_context == RunContexts.SELF_PLAY:
+            # Sample moves proportional to visits for diverse games
+            return dict(temperature=1.0)
+        return {}
+
+    def set_up(self, **kwargs):
+        seed = self.environment.random_seed + self.agent_num
+        self.rng = random.Random(seed)
+        if self.use_transposition_table:
+            self.table = TranspositionTable(max_size=self.transposition_table_size)
+        self.tree = None
+        self.last_search = {}
+        self.last_policy = {}
+
+    def handle_event(self, event):
+        '''
+        Reuse the subtree below the chosen action, if it was searched.
+        '''
+        tree = self.tree
+        if tree is None:
+            return
+        child = tree.child_for_action(self.root, event.action)
+        if child == NO_CHILD:
+            self.tree = None
+            return
+        self.root = child
+
+    def catch_up(self, events):
+        '''
+        Searches restart from wherever the game ends up, so there's
+        nothing to follow event by event.
+        '''
+        self.tree = None
+
+    def is_client(self):
+        return False
+
+    # Environment access (through the transposition table, if any)
+
+    def transition(self, state, action):
+        if self.table is not None:
+            return self.table.transition(self.environment, state, action)
+        return self.environment.transition(state, action)
+
+    def eligible_actions(self, state):
+        if self.table is not None:
+            return self.table.eligible_actions(state)
+        return state.eligible_actions()
+
+    def is_terminal(self, state):
+        if self.table is not None:
+            return self.table.is_terminal(state)
+        return state.is_terminal()
+
+    def rewards(self, state):
+        if self.table is not None:
+            return self.table.rewards(state)
+        return state.rewards()
+
+    # Search
+
+    def reset_tree(self, state):
+        self.tree = SearchTree()
+        self.root = self.tree.add_node(state)
+
+    def evaluate(self, state) -> Values:
+        '''
+        Value of :state for every agent: rewards of a uniformly random
+        playout to a terminal state.
+
+        Playouts never go through the transposition table: their
+        states are visited once, so caching them would only push tree
+        nodes out of it.
+        '''
+        choice = self.rng.choice
+        return self.environment.rollout(
+            state,
+            lambda state: choice(state.eligible_actions()),
+        )
+
+    def expand(self, node):
+        state = self.tree.node_states[node]
+        actions = self.eligible_actions(state)
+        priors = numpy.full(len(actions), 1.0 / len(actions))
+        self.tree.expand(node, actions, priors)
+
+    def select_leaf(self, virtual_loss=None):
+        '''
+        Walk from the root to a leaf with PUCT, adding the new node to
+        the tree and expanding it.
+
+        Returns (path, leaf node, values). values is only set when the
+        leaf is terminal; otherwise the leaf still needs evaluating.
+
+        With :virtual_loss, every edge on the path is charged a visit
+        and a loss right away so the next selection in the same batch
+        is steered elsewhere. backup() settles it.
+        '''
+        tree = self.tree
+        c_puct = self.c_puct
+        node = self.root
+        path = [] # (node, edge)
+        values = None
+        while True:
+            state = tree.node_states[node]
+            if self.is_terminal(state):
+                values = self.rewards(state)
+                break
+            if not tree.is_expanded(node):
+                self.expand(node)
+                break
+            edge = tree.select_edge(node, c_puct)
+            path.append((node, edge))
+            if virtual_loss is not None:
+                tree.edge_visits[edge] += 1
+                tree.edge_value_sum[edge] -= virtual_loss
+                tree.node_visits[node] += 1
+            child = tree.edge_child[edge]
+            if child == NO_CHILD:
+                action = int(tree.edge_action[edge])
+                next_state = self.transition(state, action)
+                child = tree.add_node(next_state)
+                tree.edge_child[edge] = child
+            node = child
+        return path, node, values
+
+    def simulate(self):
+        '''
+        One simulation: select down to a leaf, expand and evaluate it,
+        then back the value up the path.
+        '''
+        path, node, values = self.select_leaf()
+        if values is None:
+            values = self.evaluate(self.tree.node_states[node])
+        self.backup(path, values)
+
+    def simulate_batch(self, batch_size):
+        '''
+        :batch_size simulations whose leaves are evaluated together in
+        one evaluate_batch call.
+        '''
+        leaves = [
+            self.select_leaf(virtual_loss=VIRTUAL_LOSS)
+            for _ in range(batch_size)
+        ]
+        pending = [i for i, (_, _, values) in enumerate(leaves) if values is None]
+        if pending:
+            node_states = self.tree.node_states
+            batch_values = self.evaluate_batch([node_states[leaves[i][1]] for i in pending])
+            for i, values in zip(pending, batch_values):
+                path, node, _ = leaves[i]
+                leaves[i] = (path, node, values)
+        for path, _, values in leaves:
+            self.backup(path, values, virtual_loss=VIRTUAL_LOSS)
+
+    def evaluate_batch(self, states) -> List[Values]:
+        '''
+        evaluate() for many states at once. Uses a vectorized playout
+        for the environment if one is registered in BATCH_EVALUATORS.
+        '''
+        batch_evaluator = BATCH_EVALUATORS.get(self.environment.NAME)
+        if batch_evaluator is None:
+            return [self.evaluate(state) for state in states]
+        return batch_evaluator(states, self.rng.getrandbits(63))
+
+    def backup(self, path, values, virtual_loss=None):
+        tree = self.tree
+        for node, edge in path:
+            acting_agent = tree.node_states[node].acting_agent
+            if virtual_loss is None:
+                tree.edge_visits[edge] += 1
+                tree.edge_value_sum[edge] += values[acting_agent]
+                tree.node_visits[node] += 1
+            else:
+                # Visit was already counted by select_leaf
+                tree.edge_value_sum[edge] += values[acting_agent] + virtual_loss
+
+    def search(self, state):
+        if self.num_search_workers > 1:
+            self.search_root_parallel(state)
+            return
+
+        if (
+            self.tree is None
+            or self.tree.num_nodes > self.max_nodes
+            or self.tree.node_states[self.root].to_state_key() != state.to_state_key()
+        ):
+            self.reset_tree(state)
+
+        # Always have the root's actions, even if no simulation runs
+        # (e.g., a root-parallel worker with no share of the budget)
+        tree = self.tree
+        if not tree.is_expanded(self.root) and not self.is_terminal(state):
+            self.expand(self.root)
+
+        time_budget = self.time_budget
+        leaf_batch_size = self.leaf_batch_size
+        start = time.time()
+        simulations = 0
+        while simulations < self.num_simulations:
+            if leaf_batch_size > 1:
+                batch_size = min(leaf_batch_size, self.num_simulations - simulations)
+                self.simulate_batch(batch_size)
+                simulations += batch_size
+            else:
+                self.simulate()
+                simulations += 1
+            if time_budget is not None and time.time() - start >= time_budget:
+                break
+        self.record_search(simulations, time.time() - start)
+
+    def record_search(self, simulations, elapsed):
+        self.last_search = dict(
+            simulations=simulations,
+            elapsed=elapsed,
+            simulations_per_second=simulations / elapsed if elapsed > 0 else 0.0,
+            tree_nodes=self.tree.num_nodes,
+        )
+        if self.table is not None:
+            self.last_search["transposition_table"] = self.table.stats()
+
+    def root_stats(self):
+        tree = self.tree
+        edges = tree.edge_slice(self.root)
+        return (
+            tree.edge_action[edges].tolist(),
+            tree.edge_visits[edges].tolist(),
+            tree.edge_value_sum[edges].tolist(),
+            tree.edge_prior[edges].tolist(),
+        )
+
+    def search_root_parallel(self, state):
+        '''
+        Root parallelism: every worker searches its own tree from
+        :state with a share of the simulation budget and a different
+        seed, then the root edge statistics are summed.
+
+        Trees live in the workers, so nothing is reused between moves.
+        '''
+        # - Every worker gets at least one simulation
+        num_workers = min(self.num_search_workers, self.num_simulations)
+        settings = {
+            f.name: getattr(self, f.name)
+            for f in fields(self)
+            if f.init
+        }
+        settings["num_search_workers"] = 1
+        per_worker, extra = divmod(self.num_simulations, num_workers)
+        jobs = []
+        for i in range(num_workers):
+            worker_settings = dict(settings)
+            worker_settings["num_simulations"] = per_worker + (1 if i < extra else 0)
+            jobs.append((
+                type(self.environment),
+                worker_settings,
+                state,
+                self.agent_num,
+                self.rng.getrandbits(63),
+            ))
+
+        start = time.time()
+        results = list(search_pool(self.num_search_workers).map(_root_search_worker, jobs))
+        elapsed = time.time() - start
+
+        # Merge root edges by action
+        actions, _, _, priors = results[0][0]
+        visits = numpy.zeros(len(actions), dtype=numpy.int64)
+        value_sums = numpy.zeros(len(actions), dtype=numpy.float64)
+        action_index = {action: i for i, action in enumerate(actions)}
+        simulations = 0
+        for (w_actions, w_visits, w_value_sums, _), w_simulations in results:
+            for action, n, w in zip(w_actions, w_visits, w_value_sums):
+                i = action_index[action]
+                visits[i] += n
+                value_sums[i] += w
+            simulations += w_simulations
+
+        self.reset_tree(state)
+        tree = self.tree
+        tree.expand(self.root, actions, priors)
+        edges = tree.edge_slice(self.root)
+        tree.edge_visits[edges] = visits
+        tree.edge_value_sum[edges] = value_sums
+        tree.node_visits[self.root] = visits.sum()
+        self.record_search(simulations, elapsed)
+
+    def root_policy(self, temperature: Temperature) -> Policy:
+        '''
+        Visit-count distribution over the root's actions
+        '''
+        tree = self.tree
+        visits = tree.edge_visits[tree.edge_slice(self.root)].astype(numpy.float64)
+        if not visits.any():
+            return (numpy.ones(len(visits)) / len(visits)).tolist()
+        if temperature == 0:
+            policy = numpy.zeros(len(visits))
+            policy[numpy.argmax(visits)] = 1.0
+            return policy.tolist()
+        visits = visits ** (1.0 / temperature)
+        return (visits / visits.sum()).tolist()
+
+    def root_actions(self) -> List[Action]:
+        tree = self.tree
+        return tree.edge_action[tree.edge_slice(self.root)].tolist()
+
+    def select_action(self) -> Action:
+        state = self.environment.current_state()
+        self.search(state)
+
+        actions = self.root_actions()
+        policy = self.root_policy(self.temperature)
+        action = self.rng.choices(actions, weights=policy)[0]
+
+        # Visit distribution (temperature 1) is the self-play policy target
+        self.last_policy = dict(zip(actions, self.root_policy(1.0)))
+
+        if SETTINGS.display_puct_info:
+            self.display_search()
+        return action
+
+    def display_search(self):
+        tree = self.tree
+        edges = tree.edge_slice(self.root)
+        visits = tree.edge_visits[edges]
+        q = tree.edge_value_sum[edges] / numpy.maximum(visits, 1)
+        s = f"\nMCTS (P{self.agent_num + 1})"
+        for action, n, value, prior in zip(
+            tree.edge_action[edges],
+            visits,
+            q,
+            tree.edge_prior[edges],
+        ):
+            s += f"\n  action {action}: N={n} Q={value:+.3f} P={prior:.3f}"
+        stats = self.last_search
+        s += f"\n  simulations: {stats['simulations']}"
+        s += f"\n  sims/sec: {round(stats['simulations_per_second'])}"
+        rprint(s)
+
+
+def _root_search_worker(args):
+    '''
+    Search :state in a fresh environment/agent and return the root edge
+    statistics and the number of simulations run.
+    '''
+    Game, settings, state, agent_num, seed = args
+    env = Game()
+    env.set_seed(seed)
+    agent = Agent(**settings)
+    agent.environment = env
+    agent.set_agent_num(agent_num)
+    agent.set_up()
+    agent.search(state)
+    return agent.root_stats(), agent.last_search["simulations"]
@@ -1,9 +1,13 @@
-import math
 from timing import report_every
 
 from settings import SETTINGS
+from run_contexts import RunContexts
 from random_agent import Agent as RandomAgent
 from luckygame import Environment as LuckyGame
+from batch_runner import (
+    report_win_rate,
+    run_batch,
+)
 
 
 def play(Game):
@@ -36,24 +40,33 @@ def random_win_rate(Game, N=1000):
             agents,
             seed=None, # None will create rand seed
         )
-        game.run() # run game on CLI
-        winner = game.current_state().winner()
-        if winner == 0:
+        outcome = game.run() # run game on CLI
+        if outcome[0] > 0:
             p1_wins += 1
 
-    p = p1_wins / N
-    p1_wins_std = math.sqrt(N * p * (1 - p)) # Binomial distribution
-    error = p1_wins_std / N
+    report_win_rate(p1_wins, N)
 
-    print("\nResults")
-    print(f"  P1 games won: {p1_wins} / {N}")
-    print(f"  +/-: {round(p1_wins_std, 1)}")
-    print()
-    print(f"  P1 win rate: {round(p, 2)}")
-    print(f"  +/-: {round(error, 4)}")
-    print()
+
+def parallel_random_win_rate(
+    Game,
+    N=1000,
+    num_workers=None,
+    seed=None,
+    run_context=RunContexts.EVALUATION,
+):
+    result = run_batch(
+        Game,
+        [RandomAgent, RandomAgent],
+        N,
+        master_seed=seed,
+        num_workers=num_workers,
+        run_context=run_context,
+    )
+    result.report()
+    return result
 
 
 if __name__ == "__main__":
     play(LuckyGame)
     random_win_rate(LuckyGame, 10_000)
+    parallel_random_win_rate(LuckyGame, 10_000)
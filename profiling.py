@@ -0,0 +1,271 @@
+'''
+Opt-in profiling of the game hot paths.
+
+enable() wraps Environment.run/advance/transition and
+Agent.select_action (on the base classes and every subclass imported
+so far) with timers; disable() puts the original methods back. Nothing
+is patched until enable() is called, so when profiling is off the hot
+paths are exactly what they'd be without this module.
+
+Recorded:
+- Per-call latency histograms for each wrapped method of each class
+- Moves per game, and games/sec since enable()
+- Time split: environment (advance) vs agents (select_action)
+
+Usage:
+    import profiling
+    profiling.enable()
+    env.run()
+    profiling.PROFILER.snapshot()    # dict, or .to_json()
+    profiling.PROFILER.to_prometheus()
+
+Transitions done inside agents (e.g., MCTS searches) count toward the
+transition histograms but are agent time in the split.
+'''
+import bisect
+from dataclasses import dataclass, field
+import functools
+import json
+import threading
+import time
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Tuple,
+)
+
+from base_agent import Agent
+from base_environment import Environment
+
+# (base class, method names) that enable() wraps
+PROFILED_METHODS = (
+    (Environment, ("run", "advance", "transition")),
+    (Agent, ("select_action",)),
+)
+
+# Latency bucket upper bounds (seconds): 1us, 2us, 4us, ... ~16s
+LATENCY_BUCKETS = tuple(2 ** k * 1e-6 for k in range(25))
+
+# Moves per game bucket upper bounds
+MOVE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1_000, 2_000, 5_000, 10_000)
+
+
+@dataclass
+class Histogram:
+    bounds: Tuple[float, ...]
+
+    # counts[i] observations <= bounds[i] (and > bounds[i - 1]); the
+    # last one is everything past the last bound
+    counts: List[int] = field(init=False)
+    count: int = 0
+    total: float = 0.0
+
+    def __post_init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q) -> float:
+        '''
+        Upper bound of the bucket holding the :q quantile (inf if it's
+        past the last bound)
+        '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> Dict:
+        return dict(
+            count=self.count,
+            sum=self.total,
+            mean=self.total / self.count if self.count else 0.0,
+            p50=self.quantile(0.5),
+            p90=self.quantile(0.9),
+            p99=self.quantile(0.99),
+            buckets=dict(zip((str(b) for b in self.bounds), self.counts)),
+            overflow=self.counts[-1],
+        )
+
+
+@dataclass
+class Profiler:
+    enabled: bool = False
+    start_time: float = field(default_factory=time.perf_counter)
+
+    # "module.Class.method" -> call latency
+    calls: Dict[str, Histogram] = field(default_factory=dict)
+    moves_per_game: Histogram = field(default_factory=lambda: Histogram(MOVE_BUCKETS))
+    games: int = 0
+    environment_seconds: float = 0.0
+    agent_seconds: float = 0.0
+
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    # (class, method name, original function) for disable()
+    patched: List[Tuple[type, str, Callable]] = field(default_factory=list)
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.perf_counter()
+            self.calls = {}
+            self.moves_per_game = Histogram(MOVE_BUCKETS)
+            self.games = 0
+            self.environment_seconds = 0.0
+            self.agent_seconds = 0.0
+
+    def record_call(self, key, seconds):
+        with self.lock:
+            histogram = self.calls.get(key)
+            if histogram is None:
+                histogram = self.calls[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            elapsed = time.perf_counter() - self.start_time
+            busy = self.environment_seconds + self.agent_seconds
+            return dict(
+                enabled=self.enabled,
+                elapsed_seconds=elapsed,
+                games=self.games,
+                games_per_second=self.games / elapsed if elapsed > 0 else 0.0,
+                moves_per_game=self.moves_per_game.snapshot(),
+                environment_seconds=self.environment_seconds,
+                agent_seconds=self.agent_seconds,
+                environment_fraction=self.environment_seconds / busy if busy else 0.0,
+                calls={key: h.snapshot() for key, h in sorted(self.calls.items())},
+            )
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self, prefix="bgbots") -> str:
+        '''
+        Snapshot in the Prometheus text exposition format
+        '''
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        def histogram(name, h, labels=""):
+            cumulative = 0
+            for bound, count in h["buckets"].items():
+                cumulative += count
+                lines.append(f'{prefix}_{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_{name}_bucket{{{labels}le="+Inf"}} {h["count"]}')
+            labels = labels.rstrip(",")
+            labels = f"{{{labels}}}" if labels else ""
+            lines.append(f"{prefix}_{name}_sum{labels} {h['sum']}")
+            lines.append(f"{prefix}_{name}_count{labels} {h['count']}")
+
+        metric("profiling_enabled", "gauge", "Whether profiling is on")
+        lines.append(f"{prefix}_profiling_enabled {int(snapshot['enabled'])}")
+        metric("games_total", "counter", "Games finished since profiling started")
+        lines.append(f"{prefix}_games_total {snapshot['games']}")
+        metric("games_per_second", "gauge", "Games finished per second since profiling started")
+        lines.append(f"{prefix}_games_per_second {snapshot['games_per_second']}")
+        metric("time_seconds_total", "counter", "Time in environment (advance) vs agents (select_action)")
+        lines.append(f'{prefix}_time_seconds_total{{part="environment"}} {snapshot["environment_seconds"]}')
+        lines.append(f'{prefix}_time_seconds_total{{part="agent"}} {snapshot["agent_seconds"]}')
+        metric("moves_per_game", "histogram", "Moves per finished game")
+        histogram("moves_per_game", snapshot["moves_per_game"])
+        metric("call_seconds", "histogram", "Latency of profiled calls")
+        for key, h in snapshot["calls"].items():
+            histogram("call_seconds", h, f'function="{key}",')
+        return "\n".join(lines) + "\n"
+
+
+PROFILER = Profiler()
+
+
+def subclasses(cls):
+    yield cls
+    for subclass in cls.__subclasses__():
+        yield from subclasses(subclass)
+
+
+def timed(func, key, name, profiler):
+    '''
+    :func wrapped to record its latency (and, for advance and
+    select_action, the environment/agent time split and finished
+    games)
+    '''
+    perf_counter = time.perf_counter
+    record_call = profiler.record_call
+
+    if name == "advance":
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = perf_counter()
+            result = func(self, *args, **kwargs)
+            seconds = perf_counter() - start
+            record_call(key, seconds)
+            finished = self.current_state().is_terminal()
+            with profiler.lock:
+                profiler.environment_seconds += seconds
+                if finished:
+                    profiler.games += 1
+                    profiler.moves_per_game.observe(len(self.event_history) - 1)
+            return result
+    elif name == "select_action":
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = perf_counter()
+            result = func(self, *args, **kwargs)
+            seconds = perf_counter() - start
+            record_call(key, seconds)
+            with profiler.lock:
+                profiler.agent_seconds += seconds
+            return result
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            result = func(*args, **kwargs)
+            record_call(key, perf_counter() - start)
+            return result
+    return wrapper
+
+
+def enable(profiler=PROFILER):
+    '''
+    Start profiling (and reset the stats). Only classes imported by now
+    are instrumented, so import the games/agents first.
+    '''
+    if profiler.enabled:
+        disable(profiler)
+    for base, names in PROFILED_METHODS:
+        for cls in subclasses(base):
+            for name in names:
+                func = cls.__dict__.get(name)
+                if func is None or getattr(func, "__isabstractmethod__", False):
+                    continue
+                key = f"{cls.__module__}.{cls.__qualname__}.{name}"
+                setattr(cls, name, timed(func, key, name, profiler))
+                profiler.patched.append((cls, name, func))
+    profiler.reset()
+    profiler.enabled = True
+
+
+def disable(profiler=PROFILER):
+    '''
+    Stop profiling and restore the original methods. Stats are kept
+    until the next enable().
+    '''
+    for cls, name, func in reversed(profiler.patched):
+        setattr(cls, name, func)
+    profiler.patched = []
+    profiler.enabled = False
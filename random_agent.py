@@ -1,5 +1,4 @@
 from dataclasses import dataclass
-import random
 from typing import ClassVar
 
 from base_agent import Agent as BaseAgent
@@ -17,9 +16,12 @@ class Agent(BaseAgent):
     def handle_event(self, event):
         pass
 
+    def catch_up(self, events):
+        pass
+
     def select_action(self) -> Action:
         actions = self.environment.current_state().eligible_actions()
-        return random.choice(actions)
+        return self.environment.rng.choice(actions)
 
     def is_client(self):
         return False
@@ -0,0 +1,266 @@
+'''
+Self-play data pipeline.
+
+Finished games are streamed into fixed-size shards of columnar .npy
+files, one file per column:
+
+    shard_00000.states.npy    (N,) int64 or (N, K) uint8 state keys
+    shard_00000.acting.npy    (N,) int8 acting agent at the state
+    shard_00000.actions.npy   (N,) int32 chosen action
+    shard_00000.policies.npy  (N, A) float32 policy target over
+                              env.possible_actions()
+    shard_00000.outcomes.npy  (N, num_agents) float32 final rewards
+    shard_00000.games.npy     (N,) int64 game index
+
+Only one shard is buffered in memory at a time. New writers append
+after the shards already in the directory. SelfPlayDataset memory-maps
+the shards for training.
+'''
+from dataclasses import dataclass, field
+import glob
+import os
+import random
+import time
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Sequence,
+)
+import numpy
+
+from settings import SETTINGS
+from run_contexts import RunContexts
+from timing import report_every
+
+COLUMNS = ("states", "acting", "actions", "policies", "outcomes", "games")
+
+
+def shard_path(directory, shard_num, column):
+    return os.path.join(directory, f"shard_{shard_num:05d}.{column}.npy")
+
+
+def existing_shards(directory) -> List[int]:
+    paths = glob.glob(os.path.join(directory, "shard_*.games.npy"))
+    return sorted(int(os.path.basename(p)[6:11]) for p in paths)
+
+
+@dataclass
+class ShardWriter:
+    directory: str
+    possible_actions: Sequence
+    num_agents: int
+    shard_size: int = 100_000
+
+    shard_num: int = field(init=False)
+    count: int = field(init=False, default=0)
+    num_games: int = field(init=False, default=0)
+    buffers: Optional[Dict[str, numpy.ndarray]] = field(init=False, default=None)
+    action_index: Dict = field(init=False)
+
+    def __post_init__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        shards = existing_shards(self.directory)
+        self.shard_num = shards[-1] + 1 if shards else 0
+        self.action_index = {a: i for i, a in enumerate(self.possible_actions)}
+
+        # Keep game indices unique across appended runs
+        if shards:
+            games = numpy.load(shard_path(self.directory, shards[-1], "games"), mmap_mode="r")
+            self.num_games = int(games[-1]) + 1 if len(games) else 0
+
+    def allocate(self, state_key):
+        '''
+        Allocate the shard buffers. State key width comes from the
+        first record (int keys -> int64, bytes keys -> uint8 rows).
+        '''
+        N = self.shard_size
+        if isinstance(state_key, int):
+            states = numpy.zeros(N, dtype=numpy.int64)
+        else:
+            states = numpy.zeros((N, len(state_key)), dtype=numpy.uint8)
+        self.buffers = dict(
+            states=states,
+            acting=numpy.zeros(N, dtype=numpy.int8),
+            actions=numpy.zeros(N, dtype=numpy.int32),
+            policies=numpy.zeros((N, len(self.possible_actions)), dtype=numpy.float32),
+            outcomes=numpy.zeros((N, self.num_agents), dtype=numpy.float32),
+            games=numpy.zeros(N, dtype=numpy.int64),
+        )
+
+    def add(self, state, action, policy: Dict, outcome, game_num):
+        state_key = state.to_state_key()
+        if self.buffers is None:
+            self.allocate(state_key)
+        buffers = self.buffers
+        i = self.count
+
+        if isinstance(state_key, int):
+            buffers["states"][i] = state_key
+        else:
+            buffers["states"][i] = numpy.frombuffer(state_key, dtype=numpy.uint8)
+        buffers["acting"][i] = state.acting_agent
+        buffers["actions"][i] = action
+        policy_row = buffers["policies"][i]
+        policy_row[:] = 0.0
+        action_index = self.action_index
+        for a, p in policy.items():
+            policy_row[action_index[a]] = p
+        buffers["outcomes"][i] = outcome
+        buffers["games"][i] = game_num
+
+        self.count += 1
+        if self.count == self.shard_size:
+            self.flush()
+
+    def add_game(self, env, policies: List[Dict]):
+        '''
+        Add every move of a finished game.
+
+        :policies[i] is the policy target for the i-th action; moves
+        without one ({} or None) get a one-hot on the chosen action.
+        '''
+        event_history = env.event_history
+        outcome = event_history[-1].rewards
+        game_num = self.num_games
+        for i in range(1, len(event_history)):
+            state = event_history[i - 1].state
+            action = event_history[i].action
+            policy = policies[i - 1] or {action: 1.0}
+            self.add(state, action, policy, outcome, game_num)
+        self.num_games += 1
+
+    def flush(self):
+        if not self.count:
+            return
+        for column in COLUMNS:
+            # Write then rename so readers never see a partial shard
+            path = shard_path(self.directory, self.shard_num, column)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                numpy.save(f, self.buffers[column][:self.count])
+            os.replace(tmp_path, path)
+        self.shard_num += 1
+        self.count = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@dataclass
+class SelfPlayDataset:
+    '''
+    Memory-mapped view of all shards in a directory.
+
+    shard(i) returns zero-copy memmaps of a shard's columns; sample()
+    copies only the rows it draws.
+    '''
+    directory: str
+
+    shards: List[Dict[str, numpy.ndarray]] = field(init=False)
+    offsets: numpy.ndarray = field(init=False)
+
+    def __post_init__(self):
+        self.shards = []
+        for shard_num in existing_shards(self.directory):
+            self.shards.append({
+                column: numpy.load(
+                    shard_path(self.directory, shard_num, column),
+                    mmap_mode="r",
+                )
+                for column in COLUMNS
+            })
+        sizes = [len(shard["games"]) for shard in self.shards]
+        self.offsets = numpy.concatenate([[0], numpy.cumsum(sizes)]).astype(numpy.int64)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def shard(self, i) -> Dict[str, numpy.ndarray]:
+        return self.shards[i]
+
+    def sample(self, batch_size, rng=None) -> Dict[str, numpy.ndarray]:
+        '''
+        :batch_size rows drawn uniformly (with replacement), in the
+        order they were drawn
+        '''
+        if not len(self):
+            raise ValueError(f"No self-play rows in {self.directory}")
+        rng = rng or numpy.random.default_rng()
+        draws = rng.integers(0, len(self), size=batch_size)
+
+        # Read each shard's rows in file order, then put them back in
+        # draw order so a batch doesn't group moves of the same game
+        order = numpy.argsort(draws, kind="stable")
+        unsort = numpy.empty_like(order)
+        unsort[order] = numpy.arange(len(order))
+        rows = draws[order]
+        shard_nums = numpy.searchsorted(self.offsets, rows, side="right") - 1
+
+        batch = {}
+        for column in COLUMNS:
+            parts = []
+            for shard_num in numpy.unique(shard_nums):
+                local_rows = rows[shard_nums == shard_num] - self.offsets[shard_num]
+                parts.append(self.shards[shard_num][column][local_rows])
+            batch[column] = numpy.concatenate(parts)[unsort]
+        return batch
+
+
+def play_game(Game, agents, seed):
+    '''
+    Play one game like Environment.run, also collecting each acting
+    agent's policy target (agent.last_policy, if it has one).
+    '''
+    env = Game()
+    env.initialize(agents, seed=seed)
+    policies = []
+    while True:
+        state = env.current_state()
+        if state.is_terminal():
+            break
+        agent = env.agents[state.acting_agent]
+        action = agent.select_action()
+        policies.append(dict(getattr(agent, "last_policy", None) or {}))
+        env.advance(action)
+    return env, policies
+
+
+def run_self_play(
+    Game,
+    agent_builders,
+    num_games,
+    directory,
+    seed=None,
+    shard_size=100_000,
+):
+    SETTINGS.disable_output()
+    seed_rng = random.Random(seed)
+    agents = [
+        builder.build(env_type=Game.NAME, run_context=RunContexts.SELF_PLAY)
+        for builder in agent_builders
+    ]
+    env = Game()
+    writer = ShardWriter(
+        directory=directory,
+        possible_actions=env.possible_actions(),
+        num_agents=len(agents),
+        shard_size=shard_size,
+    )
+    start = time.time()
+    with writer:
+        for _ in range(num_games):
+            report_every("Self-play games", 100)
+            env, policies = play_game(Game, agents, seed_rng.randint(1, 100_000_000))
+            writer.add_game(env, policies)
+    return dict(
+        num_games=num_games,
+        elapsed=time.time() - start,
+        shards=writer.shard_num,
+    )
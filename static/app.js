@@ -180,7 +180,10 @@ class InputAreaView extends Component {
     .then((response) => response.json())
     .then((data) => {
       this.app.gameId = data.gameId
+      this.app.gameHistory = [];
+      this.app.historyCursor = 0;
       console.log("stashed game id: ", data.gameId)
+      this.app.streamUpdates();
     });
   }
 
@@ -191,14 +194,15 @@ class InputAreaView extends Component {
         method: "POST",
         body: JSON.stringify({
           "gameId": APP.gameId,
+          "since": this.app.historyCursor,
         })
       }
     )
     .then((response) => response.json())
     .then((data) => {
       console.log("response", data);
-      this.app.gameHistory = data.gameHistory;
-      this.app.update();
+
+      this.app.addUpdates(data);
     });
   }
 
@@ -256,6 +260,8 @@ class App extends Component {
     // this.data = entityData
     this.gameId = null;
     this.gameHistory = [];
+    this.historyCursor = 0; // Number of events in gameHistory
+    this.updateStream = null;
     this.defaultBoardState = {
       "boxes": [0, 0, 0, 0, 0],
     }
@@ -294,6 +300,42 @@ class App extends Component {
     this.update();
   }
 
+  addUpdates(data) {
+    // Only events after the request's cursor are sent, and responses
+    // (stream and manual fetches) can arrive out of order
+    // - Skip responses older than what we have
+    // - Place the rest by position, so overlaps replace, not duplicate
+    if (data.cursor < this.historyCursor) {
+      return;
+    }
+    let start = data.cursor - data.gameHistory.length;
+    this.gameHistory = this.gameHistory.slice(0, start).concat(data.gameHistory);
+    this.historyCursor = data.cursor;
+    this.update();
+  }
+
+  streamUpdates() {
+    // One server-sent events connection per game; the server pushes
+    // new events as soon as the game advances.
+    if (this.updateStream != null) {
+      this.updateStream.close();
+    }
+    let url = `/game_stream?gameId=${this.gameId}&since=${this.historyCursor}`;
+    this.updateStream = new EventSource(url);
+    this.updateStream.onmessage = (event) => {
+      this.addUpdates(JSON.parse(event.data));
+    };
+    this.updateStream.addEventListener("gameover", (event) => {
+      this.updateStream.close();
+      this.updateStream = null;
+    });
+    this.updateStream.addEventListener("unknowngame", (event) => {
+      // Game expired or was evicted: stop rather than reconnect
+      this.updateStream.close();
+      this.updateStream = null;
+    });
+  }
+
   update() {
     // Get current board state (or default)
     var boardState = this.defaultBoardState;
@@ -0,0 +1,133 @@
+'''
+Cached static files for gameserver.
+
+Each file is read (and gzipped) once, then served from memory until
+its mtime changes. Responses carry ETag/Last-Modified so browsers
+revalidate with a 304 instead of downloading the file again.
+
+Usage (in a request handler):
+    return STATIC_ASSETS.response("app.js", "text/javascript")
+'''
+from dataclasses import dataclass, field
+import gzip
+import hashlib
+import os
+import threading
+from typing import (
+    Dict,
+)
+
+from flask import (
+    Response,
+    abort,
+    request,
+)
+from werkzeug.http import (
+    http_date,
+    parse_date,
+)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+@dataclass
+class StaticAsset:
+    path: str
+    mtime: float
+    body: bytes
+    gzip_body: bytes
+    # Header values, precomputed
+    # - ETags are quoted; the gzip variant gets its own
+    etag: str
+    gzip_etag: str
+    last_modified: str
+
+    @classmethod
+    def load(cls, path):
+        mtime = os.stat(path).st_mtime
+        with open(path, "rb") as f:
+            body = f.read()
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        return cls(
+            path=path,
+            mtime=mtime,
+            body=body,
+            gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+            etag=f'"{digest}"',
+            gzip_etag=f'"{digest}-gzip"',
+            last_modified=http_date(mtime),
+        )
+
+
+@dataclass
+class StaticAssets:
+    directory: str = STATIC_DIR
+    check_mtime: bool = True # Reload files edited since they were cached
+
+    assets: Dict[str, StaticAsset] = field(init=False, default_factory=dict)
+    lock: threading.Lock = field(init=False, default_factory=threading.Lock)
+
+    def preload(self):
+        for filename in os.listdir(self.directory):
+            self.get(filename)
+
+    def get(self, filename) -> StaticAsset:
+        '''
+        Cached asset for :filename; raises FileNotFoundError
+        '''
+        path = os.path.join(self.directory, filename)
+        asset = self.assets.get(filename)
+        if asset is not None and (not self.check_mtime or os.stat(path).st_mtime == asset.mtime):
+            return asset
+        asset = StaticAsset.load(path)
+        with self.lock:
+            self.assets[filename] = asset
+        return asset
+
+    def response(self, filename, mimetype) -> Response:
+        '''
+        Serve :filename for the current request: 304 if the client's
+        copy is current, else the gzip variant if it's accepted.
+        '''
+        if "/" in filename or filename.startswith("."):
+            abort(404)
+        try:
+            asset = self.get(filename)
+        except FileNotFoundError:
+            abort(404)
+
+        # Raw header checks: cheaper than werkzeug's parsed properties
+        request_headers = request.headers
+        use_gzip = "gzip" in request_headers.get("Accept-Encoding", "")
+        etag = asset.gzip_etag if use_gzip else asset.etag
+        headers = {
+            "ETag": etag,
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": "no-cache", # Always revalidate (cheap)
+            "Vary": "Accept-Encoding",
+        }
+
+        # Conditional request
+        # - If-None-Match wins over If-Modified-Since when both are sent.
+        #   Substring match also covers lists and weak (W/) tags.
+        # - Browsers echo Last-Modified back verbatim, so try that before
+        #   parsing the date.
+        if_none_match = request_headers.get("If-None-Match")
+        if if_none_match:
+            not_modified = etag in if_none_match or if_none_match.strip() == "*"
+        else:
+            if_modified_since = request_headers.get("If-Modified-Since")
+            not_modified = if_modified_since == asset.last_modified or (
+                if_modified_since is not None
+                and (since := parse_date(if_modified_since)) is not None
+                and int(asset.mtime) <= since.timestamp()
+            )
+        if not_modified:
+            return Response(status=304, headers=headers)
+
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            body = asset.gzip_body
+        else:
+            body = asset.body
+        return Response(body, mimetype=mimetype, headers=headers)
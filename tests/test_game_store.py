@@ -0,0 +1,94 @@
+'''
+GameStores of several workers sharing one backend
+'''
+from dataclasses import dataclass
+from typing import Any
+
+import pytest
+
+from game_store import GameStore, SQLiteBackend
+from luckygame import Environment as LuckyGame
+from random_agent import Agent as RandomAgent
+
+
+@dataclass
+class Hosted:
+    env: Any
+
+    def is_busy(self):
+        return False
+
+    def can_compact(self):
+        return self.env.current_state().is_terminal()
+
+
+def new_env():
+    env = LuckyGame()
+    env.initialize([RandomAgent.build(), RandomAgent.build()], seed=7)
+    return env
+
+
+def advance(game):
+    game.env.advance(next(iter(game.env.current_state().eligible_actions())))
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SQLiteBackend(str(tmp_path / "games.db"))
+
+
+def test_stale_copy_conflicts_and_reloads(backend):
+    a = GameStore(make_game=Hosted, backend=backend)
+    b = GameStore(make_game=Hosted, backend=backend)
+    a.add("g", Hosted(new_env()))
+    stale = a.get("g")
+    advance(stale)
+
+    # Worker B picks the game up and moves it on
+    moved = b.get("g")
+    assert len(moved.env.event_history) == 2
+    advance(moved)
+    assert backend.num_events("g") == 3
+
+    # A's copy is now behind, so its move is rejected and dropped
+    advance(stale)
+    assert a.conflicts == 1
+    assert "g" not in a
+    assert backend.num_events("g") == 3
+
+    # ...and the next get reloads the stored game
+    game = a.get("g")
+    assert game is not stale
+    assert len(game.env.event_history) == 3
+    advance(game)
+    assert backend.num_events("g") == 4
+    assert a.conflicts == 1
+
+
+def test_get_reloads_when_backend_has_more(backend):
+    a = GameStore(make_game=Hosted, backend=backend)
+    b = GameStore(make_game=Hosted, backend=backend)
+    a.add("g", Hosted(new_env()))
+    old = a.get("g")
+    advance(b.get("g"))
+
+    game = a.get("g")
+    assert a.reloads == 1
+    assert game is not old
+    assert len(game.env.event_history) == 2
+
+    # Up to date now, so no more reloads
+    assert a.get("g") is game
+    assert a.reloads == 1
+
+
+def test_sweep_deletes_idle_games_in_backend(backend):
+    a = GameStore(make_game=Hosted, backend=backend, ttl=0.0)
+    b = GameStore(make_game=Hosted, backend=backend)
+    a.add("g", Hosted(new_env()))
+    a.sweep()
+    assert "g" not in a
+    with pytest.raises(KeyError):
+        backend.num_events("g")
+    with pytest.raises(KeyError):
+        b.get("g")
@@ -0,0 +1,59 @@
+'''
+gameserver request handling, through Flask's test client
+'''
+import gameserver
+
+
+def new_game(client):
+    '''
+    Id of a new game that is waiting on the client
+    '''
+    while True:
+        game_id = client.get("/new_game").get_json()["gameId"]
+        updates = {"cursor": 0, "awaitingClient": False, "gameOver": False}
+        while not (updates["awaitingClient"] or updates["gameOver"]):
+            updates = client.post(
+                "/game_updates",
+                json={"gameId": game_id, "since": updates["cursor"], "wait": 5},
+            ).get_json()
+        if updates["awaitingClient"]:
+            return game_id
+
+
+def test_submit_action_rejects_non_int_actions():
+    client = gameserver.app.test_client()
+    game_id = new_game(client)
+    for action in (True, 2.0, "2"):
+        data = client.post("/submit_action", json={"gameId": game_id, "action": action}).get_json()
+        assert data["success"] is False
+        assert "integer" in data["error"]
+    game = gameserver.GAMES.get(game_id)
+    assert not game.jobs and game.error is None
+
+
+def test_unknown_games_are_404():
+    client = gameserver.app.test_client()
+    for response in (
+        client.post("/game_updates", json={"gameId": "nope"}),
+        client.post("/game_updates", json={"gameId": "nope", "wait": 0.1}),
+        client.post("/submit_action", json={"gameId": "nope", "action": 1}),
+        client.get("/game_stream?gameId=nope"),
+    ):
+        assert response.status_code == 404
+        assert response.get_json() == {"gameId": "nope", "error": "unknown game"}
+
+
+def test_bad_since_and_wait_are_400():
+    client = gameserver.app.test_client()
+    game_id = new_game(client)
+    for response in (
+        client.post("/game_updates", json={"gameId": game_id, "since": "1"}),
+        client.post("/game_updates", json={"gameId": game_id, "since": -1}),
+        client.post("/game_updates", json={"gameId": game_id, "wait": "1"}),
+        client.post("/game_updates", json={"gameId": game_id, "wait": -1}),
+        client.post("/submit_actions", json={"moves": [{"gameId": game_id, "since": "1"}]}),
+        client.post("/submit_actions", json={"moves": [], "wait": "1"}),
+        client.get(f"/game_stream?gameId={game_id}&since=abc"),
+        client.get(f"/game_stream?gameId={game_id}", headers={"Last-Event-ID": "-1"}),
+    ):
+        assert response.status_code == 400
@@ -0,0 +1,43 @@
+'''
+Gatherer state keys and game logs must mean the same thing in every
+process (they refer to EFFECT_CARDS by index).
+'''
+import os
+import subprocess
+import sys
+
+from game_log import read_game_logs
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WRITE_LOG = '''
+import sys
+from game_log import GameLog, GameLogWriter
+from gatherer import Environment
+from random_agent import Agent as RandomAgent
+from settings import SETTINGS
+
+SETTINGS.disable_output()
+env = Environment()
+env.initialize([RandomAgent.build()], seed=7)
+env.run()
+with GameLogWriter(sys.argv[1]) as writer:
+    writer.write(GameLog.from_env(env))
+state = env.current_state()
+print(repr([state.card(r, c) for r in range(4) for c in range(4)]))
+'''
+
+
+def test_game_log_restores_in_another_process(tmp_path):
+    path = str(tmp_path / "games.jsonl")
+    written = subprocess.run(
+        [sys.executable, "-c", WRITE_LOG, path],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    log, = read_game_logs(path)
+    state = log.restore().current_state()
+    cards = [state.card(r, c) for r in range(4) for c in range(4)]
+    assert repr(cards) == written.stdout.strip().splitlines()[-1]
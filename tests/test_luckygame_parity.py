@@ -0,0 +1,10 @@
+'''
+The batched LuckyGame engine must play the same game as
+luckygame.Environment (same distribution of winners and lengths).
+'''
+from benchmarks import check_luckygame_parity
+
+
+def test_batched_matches_environment():
+    # Seeded, so this is deterministic; sizes keep it to a few seconds
+    check_luckygame_parity(num_env_games=20_000, num_batched_games=200_000)
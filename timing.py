@@ -1,19 +1,70 @@
-from collections import defaultdict
-from dataclasses import dataclass
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+import math
 import time
+from typing import (
+    Deque,
+    Dict,
+)
 from rich import print as rprint
 
+# How many of the latest splits percentiles are taken over
+SPLIT_WINDOW = 100
 
-@dataclass
+
+@dataclass(slots=True)
 class LoopInfo:
-    start_time: float = None
-    last_split_time: float = None
-    counter: int = 0
+    '''
+    Rate tracking for one loop (see report_every). Times are
+    perf_counter_ns.
+    '''
+    start_ns: int = field(default_factory=time.perf_counter_ns)
+    last_split_ns: int = field(init=False)
+    counter: int = 0 # Elements completed
+    last_split_counter: int = 0
+    next_split: int = 0 # Split once counter reaches this
+    # Elements/sec of each of the latest splits
+    split_rates: Deque[float] = field(default_factory=lambda: deque(maxlen=SPLIT_WINDOW))
 
     def __post_init__(self):
-        t = time.time()
-        self.start_time = t
-        self.last_split_time = t
+        self.last_split_ns = self.start_ns
+
+    def split(self, now_ns):
+        '''
+        Close the current split at :now_ns
+        '''
+        elapsed_ns = now_ns - self.last_split_ns
+        if elapsed_ns > 0:
+            self.split_rates.append((self.counter - self.last_split_counter) * 1e9 / elapsed_ns)
+        self.last_split_ns = now_ns
+        self.last_split_counter = self.counter
+
+    def total_rate(self, now_ns=None) -> float:
+        elapsed_ns = (now_ns or time.perf_counter_ns()) - self.start_ns
+        return self.counter * 1e9 / elapsed_ns if elapsed_ns > 0 else 0.0
+
+    def split_percentile(self, q) -> float:
+        '''
+        :q (0-100) percentile of the windowed split rates (nearest rank)
+        '''
+        rates = sorted(self.split_rates)
+        if not rates:
+            return 0.0
+        return rates[max(math.ceil(q / 100 * len(rates)) - 1, 0)]
+
+    def stats(self) -> Dict:
+        now_ns = time.perf_counter_ns()
+        split_rates = self.split_rates
+        return dict(
+            count=self.counter,
+            elapsed=(now_ns - self.start_ns) / 1e9,
+            total_rate=self.total_rate(now_ns),
+            split_rate=split_rates[-1] if split_rates else 0.0,
+            num_splits=len(split_rates),
+            split_p10=self.split_percentile(10),
+            split_p50=self.split_percentile(50),
+            split_p90=self.split_percentile(90),
+        )
 
 
 TIMING_LOOP_DATA = defaultdict(LoopInfo)
@@ -34,33 +85,57 @@ def format_count(count):
     return "{:,}".format(count)
 
 
-def report_every(loop_key, every_n=1000, elements_per_call=1):
-    # XXX Fix split
+def report_every(loop_key, every_n=1000, elements_per_call=1, display=True):
+    '''
+    Count :elements_per_call more elements done in loop :loop_key and,
+    each time another :every_n have been done, close a split and
+    (if :display) print the split and total rates. Returns the number
+    of elements done so far.
+
+    The clock is only read when a split closes, so this is cheap to
+    leave in tight loops. Query the rates with loop_stats.
+    '''
     loop_info = TIMING_LOOP_DATA[loop_key]
-    loop_info.counter += 1
-    num_completed = (loop_info.counter + 1) * elements_per_call
-    if num_completed % every_n == 0:
-        now = time.time()
-        elapsed = now - loop_info.start_time
-        rate = num_completed / elapsed
-
-        split_elapsed = now - loop_info.last_split_time
-        split_rate = (every_n) / split_elapsed
-        loop_info.last_split_time = now
-
-        rate = format_rate(rate)
-        split_rate = format_rate(split_rate)
+    loop_info.counter += elements_per_call
+    num_completed = loop_info.counter
+    if num_completed < loop_info.next_split:
+        return num_completed
+
+    # First call: set the first threshold
+    if loop_info.next_split == 0:
+        loop_info.next_split = every_n
+        if num_completed < every_n:
+            return num_completed
+
+    # Close split
+    # - A call can cross several every_n boundaries
+    now_ns = time.perf_counter_ns()
+    loop_info.split(now_ns)
+    loop_info.next_split = (num_completed // every_n + 1) * every_n
+    if display:
         rprint(
             loop_key,
             format_count(num_completed),
-            f"split:{split_rate}",
-            f"total:{rate}",
+            f"split:{format_rate(loop_info.split_rates[-1] if loop_info.split_rates else 0.0)}",
+            f"total:{format_rate(loop_info.total_rate(now_ns))}",
         )
 
     # useful to return index so you can break on loop over X
     return num_completed
 
 
+def loop_stats(loop_key) -> Dict:
+    '''
+    Counts and rates of a report_every loop: total rate, last split
+    rate, and percentiles of the last SPLIT_WINDOW split rates
+    '''
+    return TIMING_LOOP_DATA[loop_key].stats()
+
+
+def reset_loop(loop_key):
+    TIMING_LOOP_DATA.pop(loop_key, None)
+
+
 class Timer:
 
     def __enter__(self):
@@ -0,0 +1,139 @@
+'''
+Bounded LRU transposition table keyed on State.to_state_key.
+
+State caches eligible_actions/is_terminal per instance, but every
+transition builds a new State, so the same position reached by a
+different path (or revisited by a search) starts from scratch. The table
+shares that work across every instance of a position.
+
+Usage:
+    table = TranspositionTable(max_size=100_000)
+    actions = table.eligible_actions(state)
+    next_state = table.transition(env, state, action)
+
+States handed out by :transition are shared, so callers must treat them
+as immutable (don't use them with in-place move APIs).
+'''
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import (
+    Dict,
+    List,
+    Optional,
+)
+
+from custom_types import (
+    Action,
+    Rewards,
+    StateKey,
+)
+
+
+@dataclass
+class TableEntry:
+    eligible_actions: Optional[List[Action]] = None
+    is_terminal: Optional[bool] = None
+    rewards: Optional[Rewards] = None
+    transitions: Optional[Dict[Action, object]] = None
+
+
+@dataclass
+class TranspositionTable:
+    max_size: int = 100_000
+    cache_transitions: bool = True
+
+    entries: "OrderedDict[StateKey, TableEntry]" = field(
+        init=False,
+        default_factory=OrderedDict,
+    )
+    hits: int = field(init=False, default=0)
+    misses: int = field(init=False, default=0)
+    evictions: int = field(init=False, default=0)
+
+    def entry(self, state) -> TableEntry:
+        '''
+        Get (or make) the entry for :state and mark it most recently
+        used.
+        '''
+        entries = self.entries
+        key = state.to_state_key()
+        entry = entries.get(key)
+        if entry is None:
+            entry = TableEntry()
+            entries[key] = entry
+            if len(entries) > self.max_size:
+                entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            entries.move_to_end(key)
+        return entry
+
+    def eligible_actions(self, state) -> List[Action]:
+        entry = self.entry(state)
+        if entry.eligible_actions is None:
+            self.misses += 1
+            entry.eligible_actions = state.eligible_actions()
+        else:
+            self.hits += 1
+            state._cached_eligible_actions = entry.eligible_actions
+        return entry.eligible_actions
+
+    def is_terminal(self, state) -> bool:
+        entry = self.entry(state)
+        if entry.is_terminal is None:
+            self.misses += 1
+            entry.is_terminal = state.is_terminal()
+        else:
+            self.hits += 1
+            state._cached_is_terminal = entry.is_terminal
+        return entry.is_terminal
+
+    def rewards(self, state) -> Rewards:
+        entry = self.entry(state)
+        if entry.rewards is None:
+            self.misses += 1
+            entry.rewards = state.rewards()
+        else:
+            self.hits += 1
+            state._cached_rewards = entry.rewards
+        return entry.rewards
+
+    def transition(self, env, state, action):
+        '''
+        env.transition(state, action), memoized when :cache_transitions
+        is set.
+        '''
+        if not self.cache_transitions:
+            return env.transition(state, action)
+
+        entry = self.entry(state)
+        if entry.transitions is None:
+            entry.transitions = {}
+        next_state = entry.transitions.get(action)
+        if next_state is None:
+            self.misses += 1
+            next_state = env.transition(state, action)
+            entry.transitions[action] = next_state
+        else:
+            self.hits += 1
+        return next_state
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict:
+        return dict(
+            size=len(self.entries),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_rate=self.hit_rate(),
+        )